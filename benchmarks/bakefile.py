@@ -0,0 +1,203 @@
+"""Scaling benchmark of the Bakefile generation.
+
+Generates a synthetic configuration with many products and versions, long chains of base
+images (`contexts`) and several cache back ends, and measures the time and peak memory of
+each phase of `bake`:
+
+* assemble_final_build_args: normalizing the build arguments of the configuration
+* BuildGraph.from_conf: indexing the targets and their dependencies
+* generate_bakefile: generating the Bakefile of all targets
+* targets_for_selector: resolving all products and one explicitly selected version of each
+* generate_cache_location: the cache-to and cache-from locations of all targets
+* filter_targets_for_shard: all shards with the modulo and the dependency strategy
+
+The time of a phase is the fastest of several runs, the peak memory is measured in a separate
+run with tracemalloc. With `--baseline`, the benchmark fails if a phase got slower or needs more
+memory than the baseline allows.
+
+Usage:
+
+    python benchmarks/bakefile.py --products 500 --versions 6 --save-baseline baseline.json
+    python benchmarks/bakefile.py --products 500 --versions 6 --baseline baseline.json
+"""
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from types import ModuleType
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from image_tools.args import assemble_final_build_args, build_bake_argparser  # noqa: E402
+from image_tools.bake import (  # noqa: E402
+    filter_targets_for_shard,
+    generate_bakefile,
+    generate_cache_from,
+    generate_cache_location,
+    targets_for_selector,
+)
+from image_tools.graph import BuildGraph  # noqa: E402
+
+SHARD_COUNT = 8
+
+CACHE: List[Dict[str, Any]] = [
+    {"type": "registry", "ref_prefix": "registry.example.com/cache", "mode": "max", "branch_scoped": True},
+    {
+        "type": "registry",
+        "ref_prefix": "registry.example.com/cache-main",
+        "cache_from": ["{ref_prefix}:{target}-{arch}", "{ref_prefix}:{previous_target}-{arch}"],
+    },
+    {"type": "gha", "scope": "bake"},
+]
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description="Measure how the Bakefile generation scales with the configuration")
+    parser.add_argument("--products", type=int, default=500, help="Number of products. Default: 500")
+    parser.add_argument("--versions", type=int, default=6, help="Versions per product. Default: 6")
+    parser.add_argument("--depth", type=int, default=10, help="Length of the chains of base images. Default: 10")
+    parser.add_argument("-n", "--runs", type=int, default=3, help="Runs per phase, the fastest counts. Default: 3")
+    parser.add_argument("--baseline", help="Fail if a phase regressed compared to this baseline file.")
+    parser.add_argument("--save-baseline", help="Write the measurements to this baseline file.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="Allowed increase of time and peak memory over the baseline. Default: 0.5 (50%%)",
+    )
+    return parser.parse_args()
+
+
+def synthetic_configuration(products: int, versions: int, depth: int) -> ModuleType:
+    """
+    Products form chains of `depth` products, where every product is built on top of the previous product of the
+    chain. All chains start from a common base product. Version `v` of a product depends on version `v` of its
+    parent, so that every target has a chain of `depth` ancestors.
+    """
+    conf = ModuleType("conf")
+    conf.args = {"STACKABLE_USER_UID": "1000", "DELETE_CACHES": "true"}  # type: ignore[attr-defined]
+    conf.cache = CACHE  # type: ignore[attr-defined]
+    base = {"name": "base", "versions": [{"product": f"1.{v}.0", "SHARED_ARG": "x"} for v in range(versions)]}
+    result = [base]
+    for index in range(products):
+        parent = "base" if index % depth == 0 else f"product-{index - 1}"
+        result.append(
+            {
+                "name": f"product-{index}",
+                "versions": [
+                    {
+                        "product": f"{index}.{v}.0",
+                        parent: f"1.{v}.0" if parent == "base" else f"{index - 1}.{v}.0",
+                        "JMX_EXPORTER": "1.0.1",
+                        "Hadoop": "3.4.0",
+                    }
+                    for v in range(versions)
+                ],
+            }
+        )
+    conf.products = result  # type: ignore[attr-defined]
+    return conf
+
+
+def measure(phase: Callable[[Any], Any], runs: int, setup: Callable[[], Any] = lambda: None) -> Dict[str, float]:
+    """
+    The fastest time of `runs` calls and the peak memory of one call. Each call gets the result of a new `setup`
+    call, which is not measured.
+    """
+    seconds = []
+    for _ in range(runs):
+        state = setup()
+        start = time.perf_counter()
+        phase(state)
+        seconds.append(time.perf_counter() - start)
+    state = setup()
+    tracemalloc.start()
+    phase(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak}
+
+
+def run_phases(args: Namespace) -> Dict[str, Dict[str, float]]:
+    bake_args = build_bake_argparser().parse_args(["--cache", "--cache-branch", "feature"])
+    bake_args.architecture = "linux/amd64"
+
+    conf = synthetic_configuration(args.products, args.versions, args.depth)
+    assemble_final_build_args(conf)
+    graph = BuildGraph.from_conf(conf)
+    targets = targets_for_selector(conf, [], graph)
+    selection = [f"{product['name']}={product['versions'][-1]['product']}" for product in conf.products]
+
+    def cache_locations(_) -> None:
+        for target in targets:
+            generate_cache_location(CACHE, target, "linux/amd64", "feature")
+            generate_cache_from(CACHE, target, "linux/amd64", target, "feature")
+
+    def shards(_) -> None:
+        for strategy in ("modulo", "dependency"):
+            for index in range(SHARD_COUNT):
+                filter_targets_for_shard(targets, SHARD_COUNT, index, strategy, graph)
+
+    result = {
+        "assemble_final_build_args": measure(
+            assemble_final_build_args,
+            args.runs,
+            lambda: synthetic_configuration(args.products, args.versions, args.depth),
+        ),
+        "BuildGraph.from_conf": measure(lambda _: BuildGraph.from_conf(conf), args.runs),
+        "generate_bakefile": measure(lambda _: generate_bakefile(bake_args, conf, graph), args.runs),
+        "targets_for_selector": measure(
+            lambda _: (targets_for_selector(conf, [], graph), targets_for_selector(conf, selection, graph)), args.runs
+        ),
+        "generate_cache_location": measure(cache_locations, args.runs),
+        "filter_targets_for_shard": measure(shards, args.runs),
+    }
+    for name, values in result.items():
+        print(
+            f"{name:28} {values['seconds'] * 1000:10.1f} ms {values['peak_bytes'] / 1024**2:10.1f} MiB", file=sys.stderr
+        )
+    print(f"{len(targets)} targets", file=sys.stderr)
+    return result
+
+
+def regressions(
+    result: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float
+) -> List[str]:
+    failures = []
+    for phase, values in baseline.items():
+        for metric, limit in values.items():
+            measured = result.get(phase, {}).get(metric)
+            if measured is not None and measured > limit * (1 + tolerance):
+                failures.append(f"{phase}: {metric} is {measured:.6g}, baseline is {limit:.6g}")
+    return failures
+
+
+def main() -> int:
+    args = parse_args()
+    result = run_phases(args)
+
+    parameters = {"products": args.products, "versions": args.versions, "depth": args.depth}
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"parameters": parameters, "phases": result}, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != parameters:
+            raise ValueError(f"The baseline was measured with {baseline['parameters']}, not {parameters}")
+        failures = regressions(result, baseline["phases"], args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Startup latency of the bake command line.
+
+Runs `bake --version`, `bake --list-products` and `bake --dry` several times each and reports the
+median and maximum wall clock time, followed by the slowest imports according to
+`python -X importtime`. Exits with 1 if the median of a command exceeds its limit or a command fails.
+
+Usage (from the directory that contains conf.py):
+
+    python benchmarks/startup.py --runs 20
+    python benchmarks/startup.py --command version --command list-products --max-ms version=80
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Dict, List, Tuple
+
+COMMANDS = {
+    "version": ["--version"],
+    "list-products": ["--list-products"],
+    "dry": ["--dry"],
+}
+
+# Median wall clock time in milliseconds, including the start of the interpreter
+DEFAULT_LIMITS = {
+    "version": 150.0,
+    "list-products": 300.0,
+    "dry": 3000.0,
+}
+
+# Number of slowest imports reported per command
+SLOWEST_IMPORTS = 5
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description="Measure the startup latency of bake")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="Runs per command. Default: 10")
+    parser.add_argument(
+        "--command",
+        action="append",
+        choices=list(COMMANDS),
+        help="Command to measure. Can be repeated. Default: all commands",
+    )
+    parser.add_argument(
+        "--max-ms",
+        action="append",
+        default=[],
+        metavar="COMMAND=MILLISECONDS",
+        help="Limit for the median wall clock time of a command. Can be repeated.",
+    )
+    parser.add_argument("-c", "--configuration", default="./conf.py", help="Configuration file. Default: ./conf.py")
+    return parser.parse_args()
+
+
+def bake(args: List[str], *options: str) -> List[str]:
+    """The same as the `bake` console script, also when image_tools isn't installed in the interpreter."""
+    return [sys.executable, *options, "-m", "image_tools.cli", *args]
+
+
+def wall_clock(cmd: List[str], runs: int, env: Dict[str, str]) -> Tuple[List[float], int]:
+    """Wall clock times in milliseconds and the exit code of the last run."""
+    times = []
+    returncode = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        returncode = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env).returncode
+        times.append((time.perf_counter() - start) * 1000)
+    return times, returncode
+
+
+def slowest_imports(cmd: List[str], env: Dict[str, str]) -> List[Tuple[float, str]]:
+    """Cumulative import times in milliseconds of the top level imports, slowest first."""
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=env)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented
+        if not name.startswith("  "):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:SLOWEST_IMPORTS]
+
+
+def main() -> int:
+    args = parse_args()
+    limits = dict(DEFAULT_LIMITS)
+    for limit in args.max_ms:
+        name, value = limit.split("=", 1)
+        limits[name] = float(value)
+
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+
+    failures = []
+    for name in args.command or list(COMMANDS):
+        cmd_args = ["--configuration", args.configuration, *COMMANDS[name]] if name != "version" else COMMANDS[name]
+        # The first run fills the configuration cache and the file system cache
+        wall_clock(bake(cmd_args), 1, env)
+        times, returncode = wall_clock(bake(cmd_args), args.runs, env)
+        median = statistics.median(times)
+        print(
+            f"bake {' '.join(cmd_args)}: median {median:.1f} ms, max {max(times):.1f} ms (limit {limits[name]:.0f} ms)"
+        )
+        for cumulative, module in slowest_imports(bake(cmd_args, "-X", "importtime"), env):
+            print(f"    {cumulative:8.1f} ms  import {module}")
+        if returncode != 0:
+            failures.append(f"{name} failed with exit code {returncode}")
+        elif median > limits[name]:
+            failures.append(f"{name} took {median:.1f} ms, limit is {limits[name]:.0f} ms")
+
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
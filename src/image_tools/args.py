@@ -5,8 +5,10 @@ import importlib.util
 import sys
 import os
 from types import ModuleType
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+from .conf_cache import ConfigurationCache, loaded_files
+from .conf_cache import default_cache_dir as default_configuration_cache_dir
 from .version import version
 
 
@@ -21,9 +23,22 @@ DEFAULT_RELEASE_FORMATS = [
 ]
 
 
-def build_bake_argparser() -> ArgumentParser:
+# Optional first argument of bake. `bake plan` writes the targets and Bakefile of all shards to a file instead of
+# building them, `bake execute` builds one shard of such a plan.
+BAKE_COMMANDS = ["plan", "execute"]
+
+# Shells that `bake --completions` generates completions for
+COMPLETION_SHELLS = ["nushell"]
+
+
+def build_bake_argparser(command: Optional[str] = None) -> ArgumentParser:
+    # Imported here, `bake --list-products` only needs load_configuration()
+    from .shard import SHARD_STRATEGIES
+
     parser = ArgumentParser(
-        description=f"bake {version()} Build and publish product images. Requires docker and buildx (https://github.com/docker/buildx)."
+        prog=f"bake {command}" if command else "bake",
+        description=f"bake {version()} Build and publish product images. Requires docker and buildx (https://github.com/docker/buildx). \
+            Use 'bake plan --help' and 'bake execute --help' to plan the build of all shards once and build them separately.",
     )
     parser.add_argument("-v", "--version", help="Display version", action="store_true")
 
@@ -33,6 +48,16 @@ def build_bake_argparser() -> ArgumentParser:
         help="Configuration file. Default: './conf.py'.",
         default="./conf.py",
     )
+    parser.add_argument(
+        "--no-configuration-cache",
+        action="store_true",
+        help="Always load the configuration file instead of the cached configuration.",
+    )
+    parser.add_argument(
+        "--configuration-cache-dir",
+        default=default_configuration_cache_dir(),
+        help=f"Directory for the cached configuration. Default: {default_configuration_cache_dir()}",
+    )
 
     parser.add_argument(
         "-i",
@@ -53,6 +78,17 @@ def build_bake_argparser() -> ArgumentParser:
         action="append",
         help="Product to build images for. For example 'druid' or 'druid=28.0.1' to build a specific version.",
     )
+    parser.add_argument(
+        "--with-dependents",
+        action="store_true",
+        help="Also build all images that are built on top of the selected images.",
+    )
+    parser.add_argument(
+        "--changed-since",
+        metavar="GIT_REF",
+        help="Only build the selected images whose product directory or copied files changed since the merge base \
+            with GIT_REF, and the images built on top of them. Other changes, e.g. to conf.py, select all images.",
+    )
     parser.add_argument(
         "--shard-count",
         type=positive_int,
@@ -66,15 +102,100 @@ def build_bake_argparser() -> ArgumentParser:
         default=0,
         help="Build shard number M out of --shard-count. Shards are zero-indexed.",
     )
+    parser.add_argument(
+        "--shard-strategy",
+        choices=SHARD_STRATEGIES,
+        default="modulo",
+        help="How targets are assigned to shards. 'modulo' distributes them round-robin, \
+                        'dependency' keeps targets with shared ancestor images on the same shard, \
+                        'weighted' balances the historical build durations from --timings-file. Default: modulo.",
+    )
+    parser.add_argument(
+        "--timings-file",
+        help="JSON file with historical build durations per target. Used by '--shard-strategy weighted' \
+                        and updated after every successful build.",
+    )
     parser.add_argument("-u", "--push", help="Push images.", action="store_true")
+    parser.add_argument(
+        "--executor",
+        choices=["bake", "graph"],
+        default="bake",
+        help="'bake' builds all targets with a single 'docker buildx bake' call. 'graph' builds each target \
+                        separately as soon as its base images are built, so failures only stop dependent targets. \
+                        Default: bake.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=positive_int,
+        default=0,
+        help="Retry failed builds up to N times if the error looks transient (see --retry-pattern). \
+                        With '--executor graph' only the failed targets are retried. Default: 0.",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=positive_int,
+        default=30,
+        help="Seconds to wait before the first retry. The delay doubles with every retry. Default: 30.",
+    )
+    parser.add_argument(
+        "--retry-pattern",
+        action="append",
+        help="Regular expression matching the error output of transient failures. Can be given multiple times. \
+                        Default: common registry and network errors such as 'unexpected EOF' or 'i/o timeout'.",
+    )
+    parser.add_argument(
+        "--state-file",
+        help="Record the targets built by '--executor graph' in this file, so that a failed run can be resumed.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip targets that the state file records as built with the same inputs.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=4,
+        help="Maximum number of targets built concurrently with '--executor graph'. Default: 4.",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Label images with a hash of their build inputs and skip targets whose published image has the same hash.",
+    )
     parser.add_argument("-d", "--dry", help="Dry run.", action="store_true")
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help="Use SOURCE_DATE_EPOCH (or the commit time of HEAD) as build timestamp and rewrite layer timestamps \
+                        so that images built from the same inputs have identical digests.",
+    )
+    parser.add_argument(
+        "--revision-scope",
+        choices=["repository", "product"],
+        default="repository",
+        help="Git revision recorded in the image labels. 'repository' uses HEAD, 'product' uses the last commit \
+                        that touched the product directory or the directory of one of its base images. Default: repository.",
+    )
     parser.add_argument(
         "-a",
         "--architecture",
-        help="Target platform for image. Default: linux/amd64.",
-        default="linux/amd64",
+        action="append",
+        dest="architectures",
+        help="Target platform for image. Can be given multiple times to build all platforms concurrently and \
+                        push a manifest list of the platform images. Assign a native builder to each platform with \
+                        --builder. Only the first platform updates --timings-file. Default: linux/amd64.",
         type=check_architecture_input,
     )
+    parser.add_argument(
+        "--builder",
+        action="append",
+        default=[],
+        metavar="PLATFORM=BUILDER",
+        help="Buildx builder for the images of a platform, e.g. linux/arm64=arm64-builder. Can be given multiple \
+                        times. Default: the current builder, which emulates platforms other than its own.",
+    )
     parser.add_argument(
         "-o",
         "--organization",
@@ -87,12 +208,27 @@ def build_bake_argparser() -> ArgumentParser:
         help="Image registry to publish to. Default: oci.stackable.tech.",
         default="oci.stackable.tech",
     )
+    parser.add_argument(
+        "--metrics-file",
+        help="Write per target build metrics (wall time, cached and executed steps, slowest steps, pushed bytes) \
+                        to a JSON file.",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        help="Write per target build metrics to a file in the Prometheus text format.",
+    )
     parser.add_argument(
         "--export-tags-file",
         help="Write target image tags to a text file. Useful for signing or other follow-up CI steps.",
     )
 
     parser.add_argument("--cache", help="Enable distributed build cache", action="store_true")
+    parser.add_argument(
+        "--cache-branch",
+        help="Branch of the build. Selects the cache refs of branch_scoped cache back ends and is used for the \
+            {branch} placeholder of cache_from refs. Default: GITHUB_HEAD_REF, GITHUB_REF_NAME or the checked out \
+            git branch.",
+    )
 
     parser.add_argument(
         "--list-products",
@@ -115,17 +251,64 @@ def build_bake_argparser() -> ArgumentParser:
 
     parser.add_argument(
         "--completions",
-        choices=["nushell"],
-        help="Generate shell completions. Currently supports: nushell.",
+        choices=COMPLETION_SHELLS,
+        help=f"Generate shell completions. Currently supports: {', '.join(COMPLETION_SHELLS)}.",
     )
 
+    if command == "plan":
+        parser.add_argument(
+            "--output",
+            required=True,
+            help="Write the plan to this file: the Bakefile, the targets of each shard, the input hashes and tags. \
+                Its 'matrix' property can be used as GitHub Actions matrix.",
+        )
+    elif command == "execute":
+        parser.add_argument("--plan", required=True, help="Plan file written by 'bake plan'.")
+        parser.add_argument(
+            "--shard", type=positive_int, required=True, help="Index of the shard of the plan to build."
+        )
+
     return parser
 
 
 def bake_args() -> Namespace:
-    parser = build_bake_argparser()
-
-    result = parser.parse_args()
+    argv = sys.argv[1:]
+    command = argv[0] if argv and argv[0] in BAKE_COMMANDS else None
+    parser = build_bake_argparser(command)
+
+    result = parser.parse_args(argv[1:] if command else argv)
+    result.command = command
+    result.architectures = result.architectures or ["linux/amd64"]
+    result.architecture = result.architectures[0]
+    result.builders = parse_builders(result.builder)
+
+    if result.jobs < 1:
+        raise ValueError("The number of jobs must be at least 1.")
+
+    if result.state_file and result.executor != "graph":
+        raise ValueError("--state-file requires --executor graph.")
+
+    if result.resume and not result.state_file:
+        raise ValueError("--resume requires --state-file.")
+
+    if command == "execute":
+        planned = {
+            "--product": result.product,
+            "--shard-count": result.shard_count > 1,
+            "--shard-index": result.shard_index > 0,
+            "--with-dependents": result.with_dependents,
+            "--changed-since": result.changed_since,
+            "--skip-unchanged": result.skip_unchanged,
+        }
+        options = [option for option, value in planned.items() if value]
+        if options:
+            raise ValueError(f"{', '.join(options)} can't be used with 'bake execute', the plan selects the targets.")
+
+    if command == "plan" and result.shard_index > 0:
+        raise ValueError("--shard-index can't be used with 'bake plan', the plan contains all shards.")
+
+    if command == "plan" and len(result.architectures) > 1:
+        raise ValueError("'bake plan' plans the build of a single architecture, create one plan per architecture.")
 
     if result.shard_index >= result.shard_count:
         raise ValueError(
@@ -220,6 +403,8 @@ def check_build_arg(build_args: str) -> Tuple[str, str]:
 
 
 def preflight_args() -> Namespace:
+    from .preflight_cache import default_cache_dir
+
     parser = ArgumentParser(
         description="Run OpenShift certification checks and submit results to RedHat Partner Connect portal"
     )
@@ -233,14 +418,21 @@ def preflight_args() -> Namespace:
         required=True,
         type=check_image_version_format,
     )
-    parser.add_argument("-p", "--product", help="Product to build images for", required=True)
+    parser.add_argument(
+        "-p",
+        "--product",
+        action="append",
+        required=True,
+        help="Product to check images for. Can be given multiple times.",
+    )
     parser.add_argument("-s", "--submit", help="Submit results", action="store_true")
     parser.add_argument("-d", "--dry", help="Dry run.", action="store_true")
     parser.add_argument(
         "-a",
         "--architecture",
-        help="Target platform for image. Default: linux/amd64.",
-        default="linux/amd64",
+        action="append",
+        dest="architectures",
+        help="Target platform for image. Can be given multiple times. Default: linux/amd64.",
         type=check_architecture_input,
     )
     parser.add_argument(
@@ -272,16 +464,67 @@ def preflight_args() -> Namespace:
         help="Configuration file.",
         default="./conf.py",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="Number of preflight checks to run concurrently. Default: 1.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=positive_int,
+        help="Timeout in seconds for the preflight check of a single image. Default: no timeout.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Check all images, even if an image with the same digest was checked successfully before.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help=f"Directory for cached preflight results. Default: {default_cache_dir()}",
+    )
 
     result = parser.parse_args()
 
     if result.submit and not result.token:
         raise ValueError("Missing API token for submitting results.")
 
+    if result.jobs < 1:
+        raise ValueError("The number of jobs must be at least 1.")
+
+    if result.timeout is not None and result.timeout < 1:
+        raise ValueError("The timeout must be at least 1 second.")
+
+    result.architectures = result.architectures or ["linux/amd64"]
+
     # Dummy property needed by the generate_bakefile() function
     # but not used by the preflight tool.
+    result.architecture = result.architectures[0]
+    result.release = "0.0.0-dev"
+    result.target_containerfile = "Dockerfile"
     result.cache = False
+    result.reproducible = False
+    result.revision_scope = "repository"
+
+    return result
+
+
+def parse_builders(values: List[str]) -> Dict[str, str]:
+    """
+    Builders by platform from `--builder` values.
 
+    >>> parse_builders(["linux/arm64=arm64-builder"])
+    {'linux/arm64': 'arm64-builder'}
+    """
+    result = {}
+    for value in values:
+        platform, separator, builder = value.partition("=")
+        if not separator or not builder:
+            raise ValueError(f"Invalid builder [{value}]. Expected PLATFORM=BUILDER.")
+        result[check_architecture_input(platform)] = builder
     return result
 
 
@@ -294,11 +537,50 @@ def check_architecture_input(architecture: str) -> str:
     return architecture
 
 
-def load_configuration(conf_file_name: str, cli_build_args: List[Tuple[str, str]] = []) -> ModuleType:
+def prune_cache_args() -> Namespace:
+    parser = ArgumentParser(description="Delete the build cache refs written by the builds of a branch")
+
+    parser.add_argument("-v", "--version", help="Display version", action="store_true")
+
+    parser.add_argument(
+        "-c",
+        "--configuration",
+        help="Configuration file. Default: './conf.py'.",
+        default="./conf.py",
+    )
+
+    parser.add_argument("-b", "--branch", help="Branch whose cache refs are deleted, e.g. after it was merged.")
+
+    parser.add_argument("-d", "--dry", action="store_true", help="Only print the cache refs that would be deleted.")
+
+    result = parser.parse_args()
+
+    if not result.version and not result.branch:
+        raise ValueError("--branch is required.")
+
+    return result
+
+
+def load_configuration(
+    conf_file_name: str, cli_build_args: List[Tuple[str, str]] = [], cache_dir: Optional[str] = None
+) -> ModuleType:
     """Load the configuration module conf.py and potentially override build arguments
     with values provided by the user with the --build-arg flag.
     The build arguments are key, value pairs from the "conf.products.<product name>.versions.<version>" dictionary.
+
+    With a `cache_dir`, the normalized configuration is cached until conf.py or one of the modules it imports changes.
     """
+    cache = ConfigurationCache(cache_dir) if cache_dir else None
+    module = cache.get(conf_file_name) if cache else None
+    if module is None:
+        module = execute_configuration(conf_file_name, cache)
+    else:
+        sys.modules[module.__name__] = module
+    apply_cli_build_args(module, cli_build_args)
+    return module
+
+
+def execute_configuration(conf_file_name: str, cache: Optional[ConfigurationCache] = None) -> ModuleType:
     module_name = "conf"
     sys.path.append(str(os.getcwd()))
     spec = importlib.util.spec_from_file_location(module_name, conf_file_name)
@@ -306,12 +588,23 @@ def load_configuration(conf_file_name: str, cli_build_args: List[Tuple[str, str]
         module = importlib.util.module_from_spec(spec)
         sys.modules[module_name] = module
         if spec.loader:
+            modules_before = list(sys.modules)
             spec.loader.exec_module(module)
-            assemble_final_build_args(module, cli_build_args)
+            assemble_final_build_args(module)
+            if cache:
+                cache.put(conf_file_name, module, loaded_files(conf_file_name, modules_before))
             return module
     raise ImportError(name=module_name, path=conf_file_name)
 
 
+def apply_cli_build_args(conf: ModuleType, cli_build_args: List[Tuple[str, str]]) -> None:
+    """Overrides the build arguments of all product versions. Same as passing them to assemble_final_build_args()."""
+    cli_build_args_dict = {k.lower(): v for k, v in cli_build_args or []}
+    if cli_build_args_dict:
+        for product in conf.products:
+            product["versions"] = [{**version_args, **cli_build_args_dict} for version_args in product["versions"]]
+
+
 def assemble_final_build_args(conf: ModuleType, cli_build_args: List[Tuple[str, str]] = []) -> None:
     cli_build_args = cli_build_args or []
     # Convert user_build_args to a dictionary with lowercase keys for easier, case-insensitive lookup
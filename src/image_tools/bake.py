@@ -7,31 +7,51 @@ Usage:
     python -m image_tools.bake -p opa -i 22.12.0
 """
 
-import copy
 import json
 import logging
+import os
+import platform
+import re
 import sys
+import tempfile
+import time
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from functools import cache
-from subprocess import CalledProcessError, run
-from typing import Any, Dict, List
+from subprocess import PIPE, CalledProcessError, Popen, run
+from typing import Any, Collection, Dict, List, NamedTuple, Optional, Set, Tuple
 
+from .cli import print_product_versions_json
+from .builder_pool import BuilderPool, load_builders
 from .completions import print_completion
 from .args import bake_args, load_configuration
-from .lib import Command
+from .executor import (
+    SUCCEEDED,
+    RetryPolicy,
+    critical_path,
+    execute_graph,
+    predict_makespan,
+    retry,
+    topological_waves,
+)
+from .graph import BuildGraph, bakefile_target_name_for_product_version
+from .input_hash import (
+    add_input_hash_labels,
+    is_source,
+    skip_unchanged_targets,
+    target_input_hashes,
+    target_sources,
+)
+from .lib import Command, run_and_capture
+from .local_cache import cache_destination, cache_source, commit_local_caches, is_complete
+from .metrics import read_metadata_file, run_with_metrics, write_json_report, write_prometheus_textfile
+from .state import RunState, target_fingerprints
+from .shard import duplicated_builds, shard_targets, target_ancestors, target_parents
+from .timings import estimate_durations, load_timings, split_elapsed_time, update_timings
 from .version import version
 
 
-def print_product_versions_json(conf) -> None:
-    """Prints a JSON structured output of products and their versions."""
-    products_info = {}
-    for product in conf.products:
-        products_info[product["name"]] = [version["product"] for version in product.get("versions", [])]
-
-    print(json.dumps(products_info, indent=2))
-
-
 def build_image_args(conf_build_args: Dict[str, str], release_version: str):
     """
     Returns a list of --build-arg command line arguments that are used by the
@@ -60,12 +80,13 @@ def build_image_tags(image_name: str, image_version: str, product_version: str)
     ]
 
 
-def generate_bakefile(args: Namespace, conf) -> Dict[str, Any]:
+def generate_bakefile(args: Namespace, conf, graph: Optional[BuildGraph] = None) -> Dict[str, Any]:
     """
     Generates a Bakefile (see https://docs.docker.com/build/bake/reference) describing how to build the image graph.
 
     build_and_publish_images() ensures that only the desired images are actually built.
     """
+    graph = graph or BuildGraph.from_conf(conf)
     build_cache = []
     try:
         build_cache = conf.cache
@@ -73,14 +94,17 @@ def generate_bakefile(args: Namespace, conf) -> Dict[str, Any]:
         pass
     targets = {}
     groups = {}
-    product_names: list[str] = [product["name"] for product in conf.products]
     for product in conf.products:
         product_name: str = product["name"]
         product_targets = {}
+        previous_version = None
         for version_dict in product.get("versions", []):
             product_targets.update(
-                bakefile_product_version_targets(args, product_name, version_dict, product_names, build_cache)
+                bakefile_product_version_targets(
+                    args, product_name, version_dict, graph.products.keys(), build_cache, previous_version
+                )
             )
+            previous_version = version_dict["product"]
         groups[product_name.replace("/", "_")] = {
             "targets": list(product_targets.keys()),
         }
@@ -88,36 +112,96 @@ def generate_bakefile(args: Namespace, conf) -> Dict[str, Any]:
     groups["default"] = {
         "targets": list(groups.keys()),
     }
-    return {
+    bakefile = {
         "target": targets,
         "group": groups,
     }
+    if args.revision_scope == "product":
+        apply_product_revisions(bakefile, args.reproducible, graph)
+    return bakefile
+
 
+def apply_product_revisions(bakefile: Dict[str, Any], reproducible: bool, graph: BuildGraph) -> None:
+    """
+    Replaces the repository revision of each target with the last commit that touched its product directory
+    or the product directory of one of its ancestors.
 
-def bakefile_target_name_for_product_version(product_name: str, version: str) -> str:
+    In reproducible mode, the build timestamp becomes the commit time of that revision (unless
+    SOURCE_DATE_EPOCH is set) so that commits to unrelated products don't change the image.
     """
-    Creates a normalized Bakefile target name for a given (product, version) combination.
+    directories = {name: os.path.dirname(target["dockerfile"]) for name, target in bakefile["target"].items()}
+    revisions = get_git_directory_revisions(tuple(sorted(set(directories.values()))))
+
+    for name, target in bakefile["target"].items():
+        candidates = [revisions[directories[t]] for t in {name} | graph.ancestors(name) if directories[t] in revisions]
+        if not candidates:
+            continue
+        _, revision, commit_time = min(candidates)
+        set_target_label(target, "org.opencontainers.image.revision", revision)
+        if reproducible and not os.environ.get("SOURCE_DATE_EPOCH"):
+            rfc3339_date_time = datetime.fromtimestamp(commit_time, timezone.utc).isoformat()
+            set_target_label(target, "org.opencontainers.image.created", rfc3339_date_time)
+            set_target_label(target, "build-date", rfc3339_date_time)
+            target["args"]["SOURCE_DATE_EPOCH"] = str(commit_time)
+
+
+def set_target_label(target: Dict[str, Any], key: str, value: str) -> None:
+    """Sets a label of a Bakefile target and updates the annotation with the same key, if there is one."""
+    target["labels"][key] = value
+    target["annotations"] = [
+        f"{key}={value}" if annotation.startswith(f"{key}=") else annotation for annotation in target["annotations"]
+    ]
+
+
+def prune_bakefile(bakefile: Dict[str, Any], targets: List[str]) -> Dict[str, Any]:
+    """
+    Returns a copy of the Bakefile limited to the given targets and the targets they depend on through `contexts`.
+
+    Groups are rewritten to only reference the remaining targets and groups. Empty groups are dropped.
     """
-    return f"{product_name.replace('/', '_')}-{version.replace('.', '_')}"
+    required = set(targets).union(*(target_ancestors(bakefile, target) for target in targets))
+    all_groups = bakefile.get("group", {})
+    groups: Dict[str, Any] = {}
+
+    def keep(name: str) -> bool:
+        if name in required:
+            return True
+        if name not in all_groups:
+            return False
+        if name not in groups:
+            members = [member for member in all_groups[name].get("targets", []) if keep(member)]
+            groups[name] = {**all_groups[name], "targets": members} if members else None
+        return groups[name] is not None
+
+    for name in all_groups:
+        keep(name)
+
+    return {
+        "target": {name: target for name, target in bakefile["target"].items() if name in required},
+        "group": {name: groups[name] for name in all_groups if groups[name] is not None},
+    }
 
 
 def bakefile_product_version_targets(
     args: Namespace,
     product_name: str,
     versions: Dict[str, str],
-    product_names: List[str],
-    cache: List[Dict[str, str]],
+    product_names: Collection[str],
+    cache: List[Dict[str, Any]],
+    previous_version: Optional[str] = None,
 ):
     """
     Creates Bakefile targets defining how to build a given product version.
 
     A product is assumed to depend on another if it defines a `versions` field with the same name as the other product.
+    `previous_version` is the version listed before this one in the configuration, its cache is used as a fallback.
     """
     image_name = f"{args.registry}/{args.organization}/{product_name}"
     tags = build_image_tags(image_name, args.image_version, versions["product"])
     build_args = build_image_args(versions, args.release)
     target_name = bakefile_target_name_for_product_version(product_name, versions["product"])
-    rfc3339_date_time = datetime.now(timezone.utc).isoformat()
+    build_timestamp = get_build_timestamp(args.reproducible)
+    rfc3339_date_time = build_timestamp.isoformat()
     revision = get_git_revision()
 
     # The build-date label is set on UBI images automatically so we want to override it to not cause confusion even though it means we have the same date in the labels multiple times
@@ -145,51 +229,105 @@ def bakefile_product_version_targets(
         },
     }
 
+    if args.reproducible:
+        # BuildKit uses this to clamp the timestamps in the image config and history
+        build_args["SOURCE_DATE_EPOCH"] = str(int(build_timestamp.timestamp()))
+
     if args.cache:
-        result[target_name]["cache-to"] = result[target_name]["cache-from"] = generate_cache_location(
-            cache, target_name, args.architecture
+        previous_target = (
+            bakefile_target_name_for_product_version(product_name, previous_version) if previous_version else None
+        )
+        branch = args.cache_branch or get_git_branch()
+        result[target_name]["cache-to"] = generate_cache_location(cache, target_name, args.architecture, branch)
+        result[target_name]["cache-from"] = generate_cache_from(
+            cache, target_name, args.architecture, previous_target, branch
         )
 
     return result
 
 
-def targets_for_selector(conf, selected_products: List[str]) -> List[str]:
-    targets = []
-    for selected_product in selected_products or (product["name"] for product in conf.products):
-        product_name, *versions = selected_product.split("=")
-        product = next((product for product in conf.products if product["name"] == product_name), None)
-        if product is None:
-            raise ValueError(f"Requested unknown product [{product_name}]")
-        for ver in versions or (ver["product"] for ver in product["versions"]):
-            targets.append(bakefile_target_name_for_product_version(product_name, ver))
-    return targets
+def targets_for_selector(conf, selected_products: List[str], graph: Optional[BuildGraph] = None) -> List[str]:
+    return (graph or BuildGraph.from_conf(conf)).select(selected_products)
 
 
-def filter_targets_for_shard(targets: List[str], shard_count: int, shard_index: int) -> List[str]:
-    return [target for i, target in enumerate(targets) if i % shard_count == shard_index]
+def targets_changed_since(graph: BuildGraph, ref: str, sources: Dict[str, List[str]]) -> List[str]:
+    """
+    Targets of the products whose directory changed since the merge base of HEAD and `ref` (including uncommitted
+    changes) and targets that copy a changed file from elsewhere (`sources`, see `target_sources`), followed by the
+    targets that depend on them. A change that belongs to no target, such as one to conf.py, affects all targets.
+    """
+    changed: Set[str] = set()
+    for path in get_git_changed_files(ref):
+        product = graph.product_for_path(path)
+        if product is not None:
+            changed.update(node.name for node in graph.products[product])
+            continue
+        copied_by = [target for target, paths in sources.items() if is_source(path, paths)]
+        if not copied_by:
+            print(
+                f"Change outside of product directories and build sources [{path}], all targets are affected",
+                file=sys.stderr,
+            )
+            return list(graph.targets)
+        changed.update(copied_by)
+    return graph.with_dependents([name for name in graph.targets if name in changed])
+
 
+def filter_targets_for_shard(
+    targets: List[str],
+    shard_count: int,
+    shard_index: int,
+    strategy: str = "modulo",
+    graph: Optional[BuildGraph] = None,
+) -> List[str]:
+    return shard_targets(targets, shard_count, strategy, graph)[shard_index]
+
+
+def print_shard_report(shards: List[List[str]], graph: BuildGraph) -> None:
+    """Prints how many targets each shard builds and how many of those builds are repeated by other shards."""
+    for index, (shard, duplicates) in enumerate(zip(shards, duplicated_builds(shards, graph))):
+        print(
+            f"Shard {index}: {len(shard)} targets, {duplicates} ancestor builds duplicated on other shards",
+            file=sys.stderr,
+        )
 
-def bake_command(args: Namespace, targets: List[str], bakefile) -> Command:
+
+def bake_command(
+    args: Namespace, targets: List[str], bakefile, export: bool = True, builder: Optional[str] = None
+) -> Command:
     """
     Returns a list of commands that need to be run in order to build and
     publish product images.
 
-    For local building, builder instances are supported.
+    For local building, builder instances are supported. Without `builder`, the builder given for the architecture
+    with `--builder` is used, otherwise the current builder.
+    Without `export`, the targets are only built (and cached) but neither loaded nor pushed.
     """
 
     if args.dry:
         target_mode = ["--print"]
+    elif not export:
+        target_mode = []
+    elif args.reproducible:
+        # Also rewrite the timestamps of the layer contents, so that unchanged inputs produce identical digests.
+        if args.push:
+            target_mode = ["--set", "*.output=type=image,push=true,rewrite-timestamp=true"]
+        else:
+            target_mode = ["--set", "*.output=type=docker,rewrite-timestamp=true"]
     else:
         if args.push:
             target_mode = ["--push"]
         else:
             target_mode = ["--load"]
 
+    builder = builder or args.builders.get(args.architecture)
+
     return Command(
         args=[
             "docker",
             "buildx",
             "bake",
+            *(["--builder", builder] if builder else []),
             "--file",
             "-",
             *targets,
@@ -199,22 +337,626 @@ def bake_command(args: Namespace, targets: List[str], bakefile) -> Command:
     )
 
 
-def generate_cache_location(cache: List[Dict[str, str]], target_name: str, arch: str) -> List[str]:
-    cache_copy = copy.deepcopy(cache)
+# Back end settings that are used by `bake` itself and not passed on to buildx
+CACHE_SETTINGS = ("ref_prefix", "cache_from", "branch_scoped", "main_branch", "directory", "max_size")
+
+
+def generate_cache_location(
+    cache: List[Dict[str, Any]], target_name: str, arch: str, branch: Optional[str] = None
+) -> List[str]:
+    """
+    Returns the caches a target is exported to. With `branch_scoped` back ends, builds of branches other than
+    the main branch write to a ref of their own, so that they don't overwrite the cache of the main branch. If the
+    branch is unknown, e.g. for a detached HEAD, they write to no ref at all.
+    Local back ends with a `directory` export to a new directory, see local_cache.py.
+    """
     result = []
 
-    for backend in cache_copy:
-        if "ref_prefix" in backend:
+    for backend in cache:
+        if backend.get("branch_scoped") and not branch:
+            warn_unknown_cache_branch()
+            continue
+        options = {k: v for k, v in backend.items() if k not in CACHE_SETTINGS}
+        if backend.get("type") == "local" and "directory" in backend:
+            options["dest"] = cache_destination(backend["directory"], target_name, arch)
+        elif "ref_prefix" in backend:
             # Need to replace the / from values like linux/amd64 because otherwise
             # the cache ref would be invalid.
             arch = arch.replace("/", "_")
-            backend["ref"] = f"{backend['ref_prefix']}:{target_name}-{arch}"
-            del backend["ref_prefix"]
-        result.append(",".join([f"{k}={v}" for k, v in backend.items()]))
+            options["ref"] = f"{backend['ref_prefix']}:{target_name}-{arch}"
+            scope = branch_scope(backend, branch)
+            if scope:
+                options["ref"] += f"-{scope}"
+        result.append(",".join([f"{k}={v}" for k, v in options.items()]))
+
+    return result
+
+
+# Refs read by default, when a back end doesn't configure `cache_from`
+DEFAULT_CACHE_FROM = ["{ref_prefix}:{target}-{arch}"]
+
+
+def generate_cache_from(
+    cache: List[Dict[str, Any]],
+    target_name: str,
+    arch: str,
+    previous_target: Optional[str] = None,
+    branch: Optional[str] = None,
+) -> List[str]:
+    """
+    Returns the caches a target is built from, in the order BuildKit should try them.
+
+    Back ends with a `ref_prefix` can list ref templates in `cache_from`. The templates can use the placeholders
+    `{ref_prefix}`, `{target}`, `{arch}`, `{previous_target}` (the target of the previous version of the same
+    product) and `{branch}`. Templates with a placeholder that has no value for this target are left out.
+
+    Builds of other branches than the main branch read the cache of their branch first and then the cache
+    of the main branch if the back end is `branch_scoped`.
+    """
+    values = {
+        "target": target_name,
+        "arch": arch.replace("/", "_"),
+        "previous_target": previous_target,
+        "branch": cache_tag(branch) if branch else None,
+    }
+    result = []
+    for backend in cache:
+        options = {k: v for k, v in backend.items() if k not in CACHE_SETTINGS}
+        if backend.get("type") == "local" and "directory" in backend:
+            source = cache_source(backend["directory"], target_name, arch)
+            # BuildKit fails to import a local cache that doesn't exist yet
+            if is_complete(source):
+                result.append(",".join([f"{k}={v}" for k, v in {**options, "src": source}.items()]))
+            continue
+        if "ref_prefix" not in backend:
+            result.append(",".join([f"{k}={v}" for k, v in options.items()]))
+            continue
+        templates = backend.get("cache_from", DEFAULT_CACHE_FROM)
+        if branch_scope(backend, branch):
+            templates = ["{ref_prefix}:{target}-{arch}-{branch}", *DEFAULT_CACHE_FROM, *templates]
+        for template in templates:
+            if any(f"{{{name}}}" in template and value is None for name, value in values.items()):
+                continue
+            ref = template.format(ref_prefix=backend["ref_prefix"], **values)
+            location = ",".join([f"{k}={v}" for k, v in {**options, "ref": ref}.items()])
+            if location not in result:
+                result.append(location)
+    return result
+
+
+def local_caches(cache: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The `local` back ends with a `directory`, which are managed by bake, see local_cache.py."""
+    return [backend for backend in cache if backend.get("type") == "local" and "directory" in backend]
+
+
+def strip_local_caches(bakefile: Dict[str, Any], cache: List[Dict[str, Any]]) -> None:
+    """
+    Removes the managed local caches from the `cache-to` and `cache-from` entries of all targets. Their export
+    directory belongs to the bake process that builds the target, and whether a local cache can be imported depends
+    on the host it is built on. A plan therefore leaves them to `bake execute`.
+    """
+    directories = tuple(os.path.join(backend["directory"], "") for backend in local_caches(cache))
+    if not directories:
+        return
+
+    def is_local(entry: str) -> bool:
+        return any(
+            option.split("=", 1)[1].startswith(directories)
+            for option in entry.split(",")
+            if option.startswith(("dest=", "src="))
+        )
+
+    for target in bakefile["target"].values():
+        for key in ("cache-to", "cache-from"):
+            if key in target:
+                target[key] = [entry for entry in target[key] if not is_local(entry)]
+
+
+def add_local_caches(bakefile: Dict[str, Any], cache: List[Dict[str, Any]], arch: str) -> None:
+    """Adds the managed local caches of this bake process to all targets of a Bakefile without them."""
+    local = local_caches(cache)
+    if not local:
+        return
+    for name, target in bakefile["target"].items():
+        target.setdefault("cache-to", []).extend(generate_cache_location(local, name, arch))
+        target.setdefault("cache-from", []).extend(generate_cache_from(local, name, arch))
+
+
+def branch_scope(backend: Dict[str, Any], branch: Optional[str]) -> Optional[str]:
+    """The tag suffix of the branch specific cache refs, or None if the main branch cache is used."""
+    if not backend.get("branch_scoped") or not branch or branch == backend.get("main_branch", "main"):
+        return None
+    return cache_tag(branch)
+
+
+@cache
+def warn_unknown_cache_branch() -> None:
+    print(
+        "The branch of the build is unknown, branch scoped caches are only read. Use --cache-branch to write them.",
+        file=sys.stderr,
+    )
+
+
+def cache_tag(value: str) -> str:
+    """
+    Replaces the characters that aren't allowed in image tags, e.g. the slashes of branch names.
+
+    >>> cache_tag("feat/opa-1.0")
+    'feat-opa-1.0'
+    """
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", value)
+
+
+def use_published_context(bakefile: Dict[str, Any], target: str, digest: str) -> None:
+    """Makes all targets that use the given target as build context use its published image instead."""
+    image = f"docker-image://{bakefile['target'][target]['tags'][0]}@{digest}"
+    for other in bakefile["target"].values():
+        for key, value in other.get("contexts", {}).items():
+            if value == f"target:{target}":
+                other["contexts"][key] = image
+
+
+def print_critical_path(
+    nodes: List[str], parents: Dict[str, List[str]], durations: Dict[str, float], jobs: int
+) -> None:
+    """Prints the longest chain of dependent targets and the predicted build time, based on historical durations."""
+    path = critical_path(nodes, parents, durations)
+    print(
+        f"Critical path: {' -> '.join(path)} ({sum(durations[t] for t in path):.0f}s)",
+        file=sys.stderr,
+    )
+    print(
+        f"Predicted build time: {predict_makespan(nodes, parents, durations, jobs):.0f}s with {jobs} concurrent targets",
+        file=sys.stderr,
+    )
+
+
+class BakeRun(NamedTuple):
+    returncode: int
+    # The end of the error output, used to detect transient errors
+    output: str
+    metadata: Dict[str, Any]
+    report: Dict[str, Dict[str, Any]]
+
+
+def run_bake(cmd: Command, targets: List[str], collect_metrics: bool) -> BakeRun:
+    """Runs a bake command once, collecting per target metrics from the progress stream if requested."""
+    if collect_metrics:
+        returncode, metrics = run_with_metrics(cmd, targets)
+        return BakeRun(returncode, metrics.errors(), metrics.metadata, metrics.report())
+    with tempfile.TemporaryDirectory() as tmp:
+        metadata_file = os.path.join(tmp, "metadata.json")
+        returncode, output = run_and_capture(
+            [*cmd.args, "--progress=plain", "--metadata-file", metadata_file], cmd.stdin
+        )
+        return BakeRun(returncode, output, read_metadata_file(metadata_file), {})
+
+
+def retry_policy(args: Namespace) -> RetryPolicy:
+    if args.retry_pattern:
+        return RetryPolicy(args.retries, args.retry_backoff, args.retry_pattern)
+    return RetryPolicy(args.retries, args.retry_backoff)
+
+
+def print_retries(retried: List[str]) -> None:
+    """Prints the builds that were retried after a transient error."""
+    for entry in retried:
+        print(f"Retried after transient error: {entry}", file=sys.stderr)
+
+
+def builder_pool(builders: List[Dict[str, Any]]) -> Optional[BuilderPool]:
+    """The pool of the configured builders, shared by the builds of all architectures."""
+    return BuilderPool(load_builders(builders)) if builders else None
+
+
+def build_target_graph(
+    args: Namespace,
+    targets: List[str],
+    bakefile: Dict[str, Any],
+    timings: Dict[str, float],
+    pool: Optional[BuilderPool] = None,
+) -> int:
+    """
+    Builds every target of the Bakefile with its own bake call, starting each one as soon as the targets
+    it depends on have been built. Targets that are only needed as build context are not exported.
+
+    With a builder pool, every target is built on a builder of the pool that builds the architecture and the
+    number of concurrent builds is the capacity of these builders. A builder given with `--builder` replaces the
+    pool.
+    """
+    nodes = list(bakefile["target"].keys())
+    platform = args.architecture
+    if args.builders.get(platform) or (pool and not pool.for_platform(platform)):
+        pool = None
+    jobs = pool.capacity(platform) if pool else args.jobs
+
+    if pool:
+        builders = pool.for_platform(platform)
+        print(
+            f"Builder pool for [{platform}]: {', '.join(f'{b.name} ({b.capacity})' for b in builders)}",
+            file=sys.stderr,
+        )
+        if len(builders) > 1 and not any(target.get("cache-from") for target in bakefile["target"].values()):
+            print("Without --cache, each builder of the pool builds the base images it needs again", file=sys.stderr)
+        if not args.dry:
+            pool.ensure(platform)
+
+    state = None
+    if args.state_file:
+        fingerprints = target_fingerprints(bakefile, targets, "push" if args.push else "load")
+        state = RunState(args.state_file, fingerprints, resume=args.resume)
+        finished = state.finished()
+        for target, digest in finished.items():
+            print(f"Target [{target}] already built in a previous run", file=sys.stderr)
+            # Pushed images are used directly, all others are rebuilt from the build cache when needed
+            if args.push and digest and target in targets:
+                use_published_context(bakefile, target, digest)
+        nodes = [target for target in nodes if target not in finished]
+
+    parents = {target: target_parents(bakefile, target) for target in nodes}
+    durations = estimate_durations(nodes, timings)
+
+    if args.dry:
+        for index, wave in enumerate(topological_waves(nodes, parents)):
+            print(f"Wave {index}: {' '.join(wave)}")
+        print_critical_path(nodes, parents, durations, jobs)
+        return 0
+
+    report: Dict[str, Dict[str, Any]] = {}
+    measured: Dict[str, float] = {}
+    retried: List[str] = []
+
+    def build(target: str) -> bool:
+        if not pool:
+            return build_on(target, None)
+        builder = pool.acquire(target, parents[target], platform)
+        print(f"Building [{target}] on builder [{builder.name}]", file=sys.stderr)
+        try:
+            return build_on(target, builder.name)
+        finally:
+            pool.release(builder)
+
+    def build_on(target: str, builder: Optional[str]) -> bool:
+        cmd = bake_command(args, [target], bakefile, export=target in targets, builder=builder)
+
+        def attempt() -> Tuple[bool, str]:
+            start = time.monotonic()
+            result = run_bake(cmd, [target], bool(args.metrics_file or args.metrics_textfile))
+            report.update(result.report)
+            if result.returncode == 0:
+                measured[target] = time.monotonic() - start
+                if state:
+                    state.record(target, result.metadata.get(target, {}).get("containerimage.digest"))
+            return result.returncode == 0, result.output
+
+        return retry(retry_policy(args), target, attempt, retried)
+
+    status = execute_graph(nodes, parents, jobs, build, durations)
+
+    for target, target_status in status.items():
+        if target_status != SUCCEEDED:
+            print(f"Target [{target}] {target_status}", file=sys.stderr)
+    print_retries(retried)
+
+    if args.metrics_file:
+        write_json_report(args.metrics_file, report)
+    if args.metrics_textfile:
+        write_prometheus_textfile(args.metrics_textfile, report)
+    if args.timings_file and measured:
+        update_timings(args.timings_file, measured, args.architecture)
+
+    return 0 if all(s == SUCCEEDED for s in status.values()) else 1
+
+
+def select_targets(args: Namespace, graph: BuildGraph, bakefile: Dict[str, Any]) -> List[str]:
+    """The targets selected by the product, dependents and changed files options, before sharding."""
+    selected = graph.select(args.product)
+    if args.with_dependents:
+        selected = graph.with_dependents(selected)
+    if args.changed_since:
+        affected = set(targets_changed_since(graph, args.changed_since, target_sources(bakefile)))
+        selected = [target for target in selected if target in affected]
+    return selected
 
+
+def skip_unchanged(bakefile: Dict[str, Any], targets: List[str]) -> Tuple[Dict[str, Any], List[str], Dict[str, str]]:
+    """
+    Removes the targets whose inputs didn't change since they were last published from the Bakefile. Also returns
+    the input hashes of the remaining targets, which are computed before the contexts of unchanged parents are
+    rewritten and match the input hash labels.
+    """
+    hashes = target_input_hashes(bakefile)
+    add_input_hash_labels(bakefile, hashes)
+    targets, skipped = skip_unchanged_targets(bakefile, targets, hashes)
+    for target in skipped:
+        print(f"Skipping unchanged target [{target}]", file=sys.stderr)
+    bakefile = prune_bakefile(bakefile, targets)
+    return bakefile, targets, {name: hashes[name] for name in bakefile["target"]}
+
+
+def create_plan(
+    args: Namespace, conf, graph: BuildGraph, bakefile: Dict[str, Any], timings: Dict[str, float]
+) -> Dict[str, Any]:
+    """
+    The plan of a sharded build: the Bakefile of all selected targets, the targets of each shard, the input hashes
+    and the tags of the targets. Each shard is built with `bake execute`, without loading the configuration again.
+    """
+    targets = select_targets(args, graph, bakefile)
+    bakefile = prune_bakefile(bakefile, targets)
+    if args.skip_unchanged:
+        bakefile, targets, hashes = skip_unchanged(bakefile, targets)
+    else:
+        hashes = target_input_hashes(bakefile)
+    shards = shard_targets(targets, args.shard_count, args.shard_strategy, graph, timings)
+    if args.shard_count > 1:
+        print_shard_report(shards, graph)
+    cache = getattr(conf, "cache", []) if args.cache else []
+    strip_local_caches(bakefile, cache)
+    return {
+        "version": version(),
+        # Options that were used to generate the Bakefile and are needed again to build it
+        "options": {"architecture": args.architecture, "reproducible": args.reproducible},
+        "cache": cache,
+        "builders": getattr(conf, "builders", []),
+        "shards": shards,
+        "input_hashes": hashes,
+        "tags": {target: bakefile["target"][target]["tags"] for target in targets},
+        # Shards without targets are left out, so that no CI job is started for them
+        "matrix": {"include": [{"shard": index} for index, shard in enumerate(shards) if shard]},
+        "bakefile": bakefile,
+    }
+
+
+def load_plan(file_name: str) -> Dict[str, Any]:
+    with open(file_name, encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != version():
+        print(
+            f"The plan [{file_name}] was created by bake {plan.get('version')}, this is bake {version()}",
+            file=sys.stderr,
+        )
+    return plan
+
+
+def execute_plan(args: Namespace, plan: Dict[str, Any]) -> int:
+    """Builds one shard of a plan written by `bake plan`."""
+    if args.shard >= len(plan["shards"]):
+        raise ValueError(f"The plan has {len(plan['shards'])} shards, there is no shard [{args.shard}]")
+    for name, value in plan["options"].items():
+        setattr(args, name, value)
+
+    targets = plan["shards"][args.shard]
+    if not targets:
+        print("No targets in this shard")
+        return 0
+
+    bakefile = prune_bakefile(plan["bakefile"], targets)
+    add_local_caches(bakefile, plan["cache"], args.architecture)
+    return build(
+        args,
+        targets,
+        bakefile,
+        load_timings(args.timings_file, args.architecture),
+        plan["cache"],
+        builder_pool(plan["builders"]),
+    )
+
+
+def build(
+    args: Namespace,
+    targets: List[str],
+    bakefile: Dict[str, Any],
+    timings: Dict[str, float],
+    cache: List[Dict[str, Any]],
+    pool: Optional[BuilderPool] = None,
+) -> int:
+    """
+    Builds the targets of the Bakefile and exports their tags. Local build caches are committed afterwards. The
+    graph executor distributes the targets over the builders of the `pool`.
+    """
+    cmd = bake_command(args, targets, bakefile)
+
+    if args.dry and args.executor == "bake":
+        print(" ".join(cmd.args))
+        nodes = list(bakefile["target"].keys())
+        # BuildKit builds all targets of a single bake call concurrently
+        print_critical_path(
+            nodes, {t: target_parents(bakefile, t) for t in nodes}, estimate_durations(nodes, timings), len(nodes)
+        )
+
+    try:
+        if args.executor == "graph":
+            returncode = build_target_graph(args, targets, bakefile, timings, pool)
+        elif (args.metrics_file or args.metrics_textfile or args.retries) and not args.dry:
+            # Retries run the whole bake call again; targets that were already built come from the build cache
+            retried: List[str] = []
+            runs: List[BakeRun] = []
+
+            def attempt() -> Tuple[bool, str]:
+                runs.append(
+                    run_bake(cmd, list(bakefile["target"].keys()), bool(args.metrics_file or args.metrics_textfile))
+                )
+                return runs[-1].returncode == 0, runs[-1].output
+
+            retry(retry_policy(args), "bake", attempt, retried)
+            print_retries(retried)
+            returncode, report = runs[-1].returncode, runs[-1].report
+            if args.metrics_file:
+                write_json_report(args.metrics_file, report)
+            if args.metrics_textfile:
+                write_prometheus_textfile(args.metrics_textfile, report)
+            if returncode != 0:
+                raise CalledProcessError(returncode, cmd.args)
+            if args.timings_file and report:
+                # Fully cached targets say nothing about how long they take to build
+                update_timings(
+                    args.timings_file,
+                    {t: values["duration_seconds"] for t, values in report.items() if values["executed_steps"]},
+                    args.architecture,
+                )
+        else:
+            start = time.monotonic()
+            returncode = run(cmd.args, input=cmd.input, check=True).returncode
+
+            if args.timings_file and not args.dry:
+                update_timings(
+                    args.timings_file, split_elapsed_time(targets, time.monotonic() - start, timings), args.architecture
+                )
+    finally:
+        if cache and not args.dry:
+            for name in commit_local_caches(cache, list(bakefile["target"]), args.architecture):
+                print(f"Evicted local build cache [{name}]", file=sys.stderr)
+
+    if args.export_tags_file:
+        with open(args.export_tags_file, "w") as tf:
+            for t in targets:
+                tf.writelines((f"{t}\n" for t in bakefile["target"][t]["tags"]))
+
+    return returncode
+
+
+def architecture_tag(tag: str, architecture: str) -> str:
+    """
+    Tag of the image of one architecture in a multi-architecture build.
+
+    >>> architecture_tag("oci.stackable.tech/sdp/opa:0.51.0-stackable0.0.0-dev", "linux/arm64")
+    'oci.stackable.tech/sdp/opa:0.51.0-stackable0.0.0-dev-arm64'
+    """
+    return f"{tag}-{architecture.split('/')[-1]}"
+
+
+# `platform.machine()` of hosts that build an architecture natively
+NATIVE_MACHINES = {
+    "linux/amd64": ("x86_64", "amd64"),
+    "linux/arm64": ("aarch64", "arm64"),
+}
+
+
+def is_native(architecture: str) -> bool:
+    return platform.machine().lower() in NATIVE_MACHINES.get(architecture, ())
+
+
+def architecture_args(args: Namespace, architecture: str) -> Namespace:
+    """
+    Arguments for building one architecture of a multi-architecture build. Metrics and state files get the
+    architecture as suffix, tags are exported for the manifest lists instead. The timings file stores the
+    durations of each architecture separately.
+    """
+    result = Namespace(**vars(args))
+    result.architecture = architecture
+    result.export_tags_file = None
+    for name in ("metrics_file", "metrics_textfile", "state_file"):
+        path = getattr(args, name)
+        if path:
+            root, extension = os.path.splitext(path)
+            setattr(result, name, f"{root}-{architecture.split('/')[-1]}{extension}")
     return result
 
 
+def manifest_list_commands(tags: Dict[str, List[str]], architectures: List[str]) -> List[Command]:
+    """Commands that push a manifest list for every tag, combining the images of all architectures."""
+    return [
+        Command(
+            args=[
+                "docker",
+                "buildx",
+                "imagetools",
+                "create",
+                "--tag",
+                tag,
+                *(architecture_tag(tag, architecture) for architecture in architectures),
+            ]
+        )
+        for target_tags in tags.values()
+        for tag in target_tags
+    ]
+
+
+def build_architectures(args: Namespace, conf, graph: BuildGraph, targets: List[str]) -> int:
+    """
+    Builds the targets for all architectures concurrently, each one on the builder given for it with `--builder`
+    or on the builders of the pool. The images of each architecture are tagged with the architecture as suffix.
+    When all architectures are built and pushed, a manifest list is pushed for every tag.
+    """
+    pool = builder_pool(getattr(conf, "builders", []))
+    for architecture in args.architectures:
+        # Only a builder that lists the platform is known to build it natively
+        pool_builds = (
+            pool is not None
+            and args.executor == "graph"
+            and any(architecture in builder.platforms for builder in pool.builders)
+        )
+        if not args.builders.get(architecture) and not pool_builds and not is_native(architecture):
+            print(
+                f"No builder given for [{architecture}], the current builder builds it with emulation unless it "
+                f"runs on a {architecture} host. Use --builder {architecture}=<builder> to build it natively.",
+                file=sys.stderr,
+            )
+
+    cache = getattr(conf, "cache", []) if args.cache else []
+    builds: Dict[str, Tuple[Namespace, List[str], Dict[str, Any]]] = {}
+    tags: Dict[str, List[str]] = {}
+    for architecture in args.architectures:
+        arch_args = architecture_args(args, architecture)
+        bakefile = prune_bakefile(generate_bakefile(arch_args, conf, graph), targets)
+        tags = {target: bakefile["target"][target]["tags"] for target in targets}
+        for target in bakefile["target"].values():
+            target["tags"] = [architecture_tag(tag, architecture) for tag in target["tags"]]
+        arch_targets = targets
+        if args.skip_unchanged:
+            bakefile, arch_targets, _ = skip_unchanged(bakefile, targets)
+        builds[architecture] = (arch_args, arch_targets, bakefile)
+
+    def build_architecture(architecture: str) -> int:
+        arch_args, arch_targets, bakefile = builds[architecture]
+        if not arch_targets:
+            print(f"No targets changed for [{architecture}] since they were last published")
+            return 0
+        try:
+            timings = load_timings(args.timings_file, architecture)
+            return build(arch_args, arch_targets, bakefile, timings, [], pool)
+        except CalledProcessError as e:
+            print(f"Build for [{architecture}] failed: {e}", file=sys.stderr)
+            return e.returncode
+
+    # The architectures are built by different builders or share the capacity of the pool
+    with ThreadPoolExecutor(max_workers=len(builds)) as executor:
+        returncodes = list(executor.map(build_architecture, builds))
+
+    if cache and not args.dry:
+        for architecture, (_, _, bakefile) in builds.items():
+            for name in commit_local_caches(cache, list(bakefile["target"]), architecture):
+                print(f"Evicted local build cache [{name}]", file=sys.stderr)
+
+    failed = next((returncode for returncode in returncodes if returncode != 0), 0)
+    if failed:
+        return failed
+
+    # Targets that were skipped for all architectures already have a manifest list
+    built = {target for _, arch_targets, _ in builds.values() for target in arch_targets}
+    tags = {target: target_tags for target, target_tags in tags.items() if target in built}
+    if args.push or args.dry:
+        for cmd in manifest_list_commands(tags, args.architectures):
+            if args.dry:
+                print(" ".join(cmd.args))
+            else:
+                run(cmd.args, check=True)
+
+    if args.export_tags_file:
+        with open(args.export_tags_file, "w") as tf:
+            for target_tags in tags.values():
+                if args.push:
+                    tf.writelines(f"{tag}\n" for tag in target_tags)
+                else:
+                    tf.writelines(
+                        f"{architecture_tag(tag, architecture)}\n"
+                        for tag in target_tags
+                        for architecture in args.architectures
+                    )
+
+    return 0
+
+
 def main() -> int:
     """Generate a Docker bake file from conf.py and build the given args.product images."""
     args = bake_args()
@@ -227,33 +969,133 @@ def main() -> int:
         print_completion(args.completions)
         return 0
 
-    conf = load_configuration(args.configuration, args.build_arg)
+    if args.command == "execute":
+        return execute_plan(args, load_plan(args.plan))
+
+    conf = load_configuration(
+        args.configuration, args.build_arg, None if args.no_configuration_cache else args.configuration_cache_dir
+    )
 
     if args.list_products:
         print_product_versions_json(conf)
         return 0
 
-    bakefile = generate_bakefile(args, conf)
+    graph = BuildGraph.from_conf(conf)
+    # Multi-architecture builds are sharded with the durations of the first architecture
+    timings = load_timings(args.timings_file, args.architecture)
+
+    bakefile = generate_bakefile(args, conf, graph)
+
+    if args.command == "plan":
+        plan = create_plan(args, conf, graph, bakefile, timings)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(plan, f, indent=2)
+            f.write("\n")
+        print(f"Planned {sum(len(shard) for shard in plan['shards'])} targets in {len(plan['shards'])} shards")
+        return 0
 
-    targets = filter_targets_for_shard(targets_for_selector(conf, args.product), args.shard_count, args.shard_index)
+    shards = shard_targets(select_targets(args, graph, bakefile), args.shard_count, args.shard_strategy, graph, timings)
+    if args.shard_count > 1:
+        print_shard_report(shards, graph)
+    targets = shards[args.shard_index]
 
     if not targets:
         print("No targets match this filter")
         return 0
 
-    cmd = bake_command(args, targets, bakefile)
+    if len(args.architectures) > 1:
+        return build_architectures(args, conf, graph, targets)
 
-    if args.dry:
-        print(" ".join(cmd.args))
+    bakefile = prune_bakefile(bakefile, targets)
 
-    result = run(cmd.args, input=cmd.input, check=True)
+    if args.skip_unchanged:
+        bakefile, targets, _ = skip_unchanged(bakefile, targets)
+        if not targets:
+            print("No targets changed since they were last published")
+            return 0
+
+    cache = getattr(conf, "cache", []) if args.cache else []
+    return build(args, targets, bakefile, timings, cache, builder_pool(getattr(conf, "builders", [])))
+
+
+@cache
+def get_build_timestamp(reproducible: bool = False) -> datetime:
+    """
+    Returns the build timestamp shared by all images of this run.
+
+    In reproducible mode the timestamp is taken from the SOURCE_DATE_EPOCH environment variable
+    or, if that is not set, from the commit time of the git HEAD.
+    """
+    if reproducible:
+        epoch = os.environ.get("SOURCE_DATE_EPOCH") or get_git_commit_time()
+        if epoch:
+            return datetime.fromtimestamp(int(epoch), timezone.utc)
+        logging.warning("No SOURCE_DATE_EPOCH or git commit time found, falling back to the current time")
+    return datetime.now(timezone.utc)
+
+
+def get_git_changed_files(ref: str) -> List[str]:
+    """Files that differ between the working tree and the merge base of HEAD and `ref`."""
+    merge_base = run(["git", "merge-base", ref, "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    result = run(["git", "diff", "--name-only", merge_base], capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()
+
+
+@cache
+def get_git_commit_time():
+    try:
+        result = run(["git", "log", "-1", "--format=%ct", "HEAD"], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except CalledProcessError as e:
+        logging.error("Failed to get git commit time: %s", e)
+        return None
+
+
+@cache
+def get_git_directory_revisions(directories: Tuple[str, ...]) -> Dict[str, Tuple[int, str, int]]:
+    """
+    Returns the last commit that touched each of the given directories as (position in the log, hash, commit time).
+
+    All directories are looked up in a single `git log` pass, which stops as soon as every directory was found.
+    Directories without any commits are missing from the result.
+    """
+    result: Dict[str, Tuple[int, str, int]] = {}
+    # Longest directories first, so nested directories are matched before their parents
+    prefixes = sorted(((d.rstrip("/") + "/", d) for d in directories), key=lambda p: len(p[0]), reverse=True)
+    try:
+        with Popen(
+            ["git", "log", "--format=%x00%H %ct", "--name-only", "--", *directories], stdout=PIPE, text=True
+        ) as git_log:
+            position, commit = 0, ("", 0)
+            for line in git_log.stdout or []:
+                line = line.rstrip("\n")
+                if line.startswith("\0"):
+                    revision, commit_time = line[1:].split(" ")
+                    position, commit = position + 1, (revision, int(commit_time))
+                    continue
+                directory = next((d for prefix, d in prefixes if line.startswith(prefix)), None)
+                if directory is not None and directory not in result:
+                    result[directory] = (position, *commit)
+                    if len(result) == len(directories):
+                        git_log.terminate()
+                        break
+    except FileNotFoundError as e:
+        logging.error("Failed to get git revisions: %s", e)
+    return result
 
-    if args.export_tags_file:
-        with open(args.export_tags_file, "w") as tf:
-            for t in targets:
-                tf.writelines((f"{t}\n" for t in bakefile["target"][t]["tags"]))
 
-    return result.returncode
+@cache
+def get_git_branch() -> Optional[str]:
+    """The branch being built. GitHub Actions check out pull requests and tags with a detached HEAD."""
+    for variable in ("GITHUB_HEAD_REF", "GITHUB_REF_NAME"):
+        if os.environ.get(variable):
+            return os.environ[variable]
+    try:
+        result = run(["git", "rev-parse", "--abbrev-ref", "HEAD"], capture_output=True, text=True, check=True)
+    except CalledProcessError:
+        return None
+    branch = result.stdout.strip()
+    return branch if branch != "HEAD" else None
 
 
 @cache
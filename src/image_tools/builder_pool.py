@@ -0,0 +1,120 @@
+"""Pool of buildx builders for the graph executor.
+
+The builders are listed in conf.py:
+
+    builders = [
+        {"name": "buildkit-1", "endpoint": "tcp://buildkit-1:1234", "platforms": ["linux/amd64"], "capacity": 2},
+        {"name": "buildkit-2", "endpoint": "tcp://buildkit-2:1234", "platforms": ["linux/amd64"], "capacity": 1},
+        {"name": "arm64", "platforms": ["linux/arm64"]},
+    ]
+
+`name` is the buildx builder name. Builders with an `endpoint` are created with the `remote` driver if
+they don't exist yet, all others must already exist. `capacity` is the number of targets the builder
+builds at the same time (default: 1), `platforms` are the platforms it builds (default: all).
+
+Each target is placed on the builder that built one of its parents, if that builder has capacity left,
+so that the parent layers are already in its local cache. Otherwise the target goes to the least loaded
+builder. Parents built on another builder are pulled from the registry cache.
+
+One pool is shared by the builds of all architectures, so that a builder that builds several platforms
+never builds more targets at the same time than its capacity.
+"""
+
+import threading
+from dataclasses import dataclass, field
+from subprocess import DEVNULL, run
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+@dataclass
+class Builder:
+    name: str
+    endpoint: Optional[str] = None
+    platforms: List[str] = field(default_factory=list)
+    capacity: int = 1
+
+    def builds(self, platform: str) -> bool:
+        return not self.platforms or platform in self.platforms
+
+
+def load_builders(builders: List[Dict[str, Any]]) -> List[Builder]:
+    """The builders of the configuration."""
+    result = []
+    for entry in builders:
+        builder = Builder(
+            name=entry["name"],
+            endpoint=entry.get("endpoint"),
+            platforms=entry.get("platforms", []),
+            capacity=int(entry.get("capacity", 1)),
+        )
+        if builder.capacity < 1:
+            raise ValueError(f"The capacity of builder [{builder.name}] must be at least 1.")
+        result.append(builder)
+    return result
+
+
+def ensure_builder(builder: Builder) -> None:
+    """Creates a builder with an endpoint using the buildx `remote` driver, unless a builder of that name exists."""
+    if run(["docker", "buildx", "inspect", builder.name], stdout=DEVNULL, stderr=DEVNULL).returncode == 0:
+        return
+    if not builder.endpoint:
+        raise ValueError(f"The builder [{builder.name}] doesn't exist and has no endpoint to create it.")
+    platforms = ["--platform", ",".join(builder.platforms)] if builder.platforms else []
+    run(
+        ["docker", "buildx", "create", "--name", builder.name, "--driver", "remote", *platforms, builder.endpoint],
+        check=True,
+    )
+
+
+class BuilderPool:
+    """Places targets on builders. Safe to use from the threads of the graph executors of all architectures."""
+
+    def __init__(self, builders: List[Builder]):
+        if not builders:
+            raise ValueError("The builder pool needs at least one builder.")
+        self.builders = builders
+        self.load = {builder.name: 0 for builder in builders}
+        # Builder of every placed target per platform, used to keep dependency chains on the same builder
+        self.placed: Dict[Tuple[str, str], Builder] = {}
+        self._ensured: Set[str] = set()
+        self._condition = threading.Condition()
+
+    def for_platform(self, platform: str) -> List[Builder]:
+        return [builder for builder in self.builders if builder.builds(platform)]
+
+    def capacity(self, platform: str) -> int:
+        return sum(builder.capacity for builder in self.for_platform(platform))
+
+    def ensure(self, platform: str) -> None:
+        """Makes sure that the builders of the platform exist."""
+        with self._condition:
+            for builder in self.for_platform(platform):
+                if builder.name not in self._ensured:
+                    ensure_builder(builder)
+                    self._ensured.add(builder.name)
+
+    def _utilization(self, builder: Builder) -> Tuple[float, int]:
+        return (self.load[builder.name] / builder.capacity, -builder.capacity)
+
+    def acquire(self, target: str, parents: List[str], platform: str) -> Builder:
+        """
+        Places the target on the least loaded builder of the platform that built one of its parents and has capacity
+        left, or else on the least loaded builder with capacity left. Waits until a builder has capacity left.
+        """
+        with self._condition:
+            while True:
+                available = [b for b in self.for_platform(platform) if self.load[b.name] < b.capacity]
+                if available:
+                    break
+                self._condition.wait()
+            parent_builders = [self.placed[(platform, p)] for p in parents if (platform, p) in self.placed]
+            candidates = [builder for builder in available if builder in parent_builders]
+            builder = min(candidates or available, key=self._utilization)
+            self.load[builder.name] += 1
+            self.placed[(platform, target)] = builder
+            return builder
+
+    def release(self, builder: Builder) -> None:
+        with self._condition:
+            self.load[builder.name] -= 1
+            self._condition.notify_all()
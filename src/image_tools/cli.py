@@ -0,0 +1,96 @@
+"""Entry point of `bake`.
+
+Shell completions and CI helper scripts call `bake --version`, `bake --completions` and
+`bake --list-products` very often. These commands are answered here, before the modules that
+are only needed to build images are imported.
+
+Usage:
+
+    python -m image_tools.cli --list-products
+"""
+
+import sys
+from typing import List, Optional
+
+
+def print_product_versions_json(conf) -> None:
+    """Prints a JSON structured output of products and their versions."""
+    import json
+
+    products_info = {}
+    for product in conf.products:
+        products_info[product["name"]] = [version["product"] for version in product.get("versions", [])]
+
+    print(json.dumps(products_info, indent=2))
+
+
+def list_products_options(argv: List[str]) -> Optional[dict]:
+    """
+    The options of a `--list-products` call, or None if it has other options that need the full argument parser.
+
+    >>> list_products_options(["--list-products", "-c", "other.py"])
+    {'configuration': 'other.py', 'cache': True}
+    >>> list_products_options(["--list-products", "-p", "opa"]) is None
+    True
+    """
+    if "--list-products" not in argv:
+        return None
+    options = {"configuration": "./conf.py", "cache": True}
+    remaining = [arg for arg in argv if arg != "--list-products"]
+    while remaining:
+        arg = remaining.pop(0)
+        if arg == "--no-configuration-cache":
+            options["cache"] = False
+        elif arg in ("-c", "--configuration", "--configuration-cache-dir") and remaining:
+            options["cache_dir" if arg == "--configuration-cache-dir" else "configuration"] = remaining.pop(0)
+        elif arg.startswith("--configuration=") or arg.startswith("--configuration-cache-dir="):
+            name, value = arg[2:].split("=", 1)
+            options["cache_dir" if name == "configuration-cache-dir" else "configuration"] = value
+        else:
+            return None
+    return options
+
+
+def fast_path(argv: List[str]) -> Optional[int]:
+    """Runs the command if it doesn't need the full `bake` and returns its exit code, otherwise returns None."""
+    if argv in (["-v"], ["--version"]):
+        from .version import version
+
+        print(version())
+        return 0
+
+    if len(argv) == 2 and argv[0] == "--completions" or len(argv) == 1 and argv[0].startswith("--completions="):
+        from .args import COMPLETION_SHELLS
+
+        shell = argv[-1].split("=", 1)[-1]
+        # Unsupported shells are rejected by the argument parser
+        if shell in COMPLETION_SHELLS:
+            from .completions import print_completion
+
+            print_completion(shell)
+            return 0
+
+    options = list_products_options(argv)
+    if options is not None:
+        from .args import load_configuration
+        from .conf_cache import default_cache_dir
+
+        cache_dir = options.get("cache_dir", default_cache_dir()) if options["cache"] else None
+        print_product_versions_json(load_configuration(options["configuration"], [], cache_dir))
+        return 0
+
+    return None
+
+
+def bake() -> int:
+    result = fast_path(sys.argv[1:])
+    if result is not None:
+        return result
+
+    from .bake import main
+
+    return main()
+
+
+if __name__ == "__main__":
+    sys.exit(bake())
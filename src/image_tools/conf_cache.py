@@ -0,0 +1,131 @@
+"""On-disk cache of the loaded configuration.
+
+Executing conf.py (and the modules it imports) and normalizing the build arguments of every
+product version adds up for shell completions, which call `bake --list-products` on every key
+press. The normalized configuration is stored as JSON together with the modification times and
+hashes of the files it was loaded from, and used as long as none of these files changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+
+from .version import version
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "image-tools", "configuration")
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def loaded_files(conf_file: str, modules_before: List[str]) -> List[str]:
+    """
+    The configuration file and the files of the modules it imported from its own directory or the working directory.
+    Modules that were already loaded before the configuration are not included.
+    """
+    roots = {os.path.dirname(os.path.abspath(conf_file)), os.getcwd()}
+    files = [os.path.abspath(conf_file)]
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if name in modules_before or not path or not os.path.isfile(path):
+            continue
+        path = os.path.abspath(path)
+        if any(os.path.commonpath([root, path]) == root for root in roots) and path not in files:
+            files.append(path)
+    return files
+
+
+def module_data(module: ModuleType) -> Optional[Dict[str, Any]]:
+    """The public attributes of the configuration module, or None if they can't be stored as JSON."""
+    data = {
+        name: value
+        for name, value in vars(module).items()
+        if not name.startswith("_") and not isinstance(value, (ModuleType, type)) and not callable(value)
+    }
+    try:
+        json.dumps(data)
+    except (TypeError, ValueError):
+        return None
+    return data
+
+
+class ConfigurationCache:
+    """Normalized configurations stored as one JSON file per configuration file."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, conf_file: str) -> str:
+        key = hashlib.sha256(os.path.abspath(conf_file).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, conf_file: str) -> Optional[ModuleType]:
+        """The cached configuration, or None if there is none or one of its files changed."""
+        try:
+            with open(self.path(conf_file), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("version") != version():
+            return None
+
+        touched = False
+        for path, recorded in entry["files"].items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if stat.st_mtime_ns == recorded["mtime_ns"] and stat.st_size == recorded["size"]:
+                continue
+            if file_hash(path) != recorded["sha256"]:
+                return None
+            recorded.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            touched = True
+        if touched:
+            try:
+                self._write(conf_file, entry)
+            except OSError as e:
+                logging.debug("Failed to update cached configuration [%s]: %s", conf_file, e)
+
+        module = ModuleType("conf")
+        module.__file__ = os.path.abspath(conf_file)
+        for name, value in entry["data"].items():
+            setattr(module, name, value)
+        return module
+
+    def put(self, conf_file: str, module: ModuleType, files: List[str]) -> bool:
+        """Stores the configuration. Returns False if it can't be stored."""
+        data = module_data(module)
+        if data is None:
+            logging.debug("Not caching configuration [%s] with attributes that can't be stored as JSON", conf_file)
+            return False
+        entry = {
+            "version": version(),
+            "files": {
+                path: {"mtime_ns": os.stat(path).st_mtime_ns, "size": os.stat(path).st_size, "sha256": file_hash(path)}
+                for path in files
+            },
+            "data": data,
+        }
+        try:
+            self._write(conf_file, entry)
+        except OSError as e:
+            logging.debug("Failed to cache configuration [%s]: %s", conf_file, e)
+            return False
+        return True
+
+    def _write(self, conf_file: str, entry: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Imported here, because the configuration is only written when it isn't cached yet
+        from .lib import write_atomic
+
+        write_atomic(self.path(conf_file), json.dumps(entry))
@@ -0,0 +1,211 @@
+"""Dependency-aware scheduling of Bakefile targets.
+
+Instead of handing all targets to a single `docker buildx bake` call, every target is built
+by its own call as soon as all targets it depends on (through `contexts`) have been built.
+A failing target only stops its own descendants; independent chains keep building.
+
+When several targets are ready, the ones on the longest remaining dependency chain (the
+critical path, weighted by historical build durations) are started first.
+"""
+
+import heapq
+import logging
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+# A target is skipped if one of its ancestors failed
+SKIPPED = "skipped"
+
+# Errors that are usually caused by the network or the registry and not by the build itself
+DEFAULT_RETRY_PATTERNS = [
+    r"unexpected EOF",
+    r"i/o timeout",
+    r"TLS handshake timeout",
+    r"connection reset by peer",
+    r"context deadline exceeded",
+    r"failed to (export|import|push|fetch|resolve) .*cache",
+    r"50[234] (Bad Gateway|Service Unavailable|Gateway Timeout)",
+    r"toomanyrequests",
+]
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often and after which errors a failed build is retried."""
+
+    retries: int = 0
+    # Seconds to wait before the first retry. Doubles with every further retry.
+    backoff: float = 30.0
+    patterns: List[str] = field(default_factory=lambda: list(DEFAULT_RETRY_PATTERNS))
+
+    def transient_error(self, output: str) -> Optional[str]:
+        """The first pattern that matches the output of a failed build, if any."""
+        return next((pattern for pattern in self.patterns if re.search(pattern, output)), None)
+
+    def delay(self, attempt: int) -> float:
+        return self.backoff * 2**attempt
+
+
+def retry(policy: RetryPolicy, name: str, attempt: Callable[[], Tuple[bool, str]], retried: List[str]) -> bool:
+    """
+    Calls `attempt` until it succeeds, fails with an error that is not transient or the retries are used up.
+    `attempt` returns whether it succeeded and its error output. Every retry is recorded in `retried`.
+    """
+    for number in range(policy.retries + 1):
+        succeeded, output = attempt()
+        if succeeded:
+            return True
+        pattern = policy.transient_error(output)
+        if pattern is None or number == policy.retries:
+            return False
+        delay = policy.delay(number)
+        print(
+            f"[{name}] failed with a transient error ({pattern}), retry {number + 1}/{policy.retries} in {delay:.0f}s",
+            file=sys.stderr,
+        )
+        retried.append(f"{name} ({pattern})")
+        time.sleep(delay)
+    return False
+
+
+def topological_waves(targets: List[str], parents: Dict[str, List[str]]) -> List[List[str]]:
+    """
+    Groups the targets into waves: every target only depends on targets of earlier waves.
+    Dependencies on targets outside of `targets` are ignored.
+    """
+    members = set(targets)
+    remaining = list(targets)
+    done: Set[str] = set()
+    waves = []
+    while remaining:
+        wave = [t for t in remaining if all(p in done or p not in members for p in parents.get(t, []))]
+        if not wave:
+            raise ValueError(f"Dependency cycle between targets {remaining}")
+        waves.append(wave)
+        done.update(wave)
+        remaining = [t for t in remaining if t not in done]
+    return waves
+
+
+def _children(targets: List[str], parents: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    members = set(targets)
+    children: Dict[str, List[str]] = {t: [] for t in targets}
+    for target in targets:
+        for parent in parents.get(target, []):
+            if parent in members:
+                children[parent].append(target)
+    return children
+
+
+def critical_path_priorities(
+    targets: List[str], parents: Dict[str, List[str]], durations: Dict[str, float]
+) -> Dict[str, float]:
+    """For each target, the duration of the longest chain from the start of the target to the end of the build."""
+    children = _children(targets, parents)
+    result: Dict[str, float] = {}
+    for wave in reversed(topological_waves(targets, parents)):
+        for target in wave:
+            result[target] = durations[target] + max((result[c] for c in children[target]), default=0.0)
+    return result
+
+
+def critical_path(targets: List[str], parents: Dict[str, List[str]], durations: Dict[str, float]) -> List[str]:
+    """The longest chain of dependent targets, weighted by duration."""
+    if not targets:
+        return []
+    priorities = critical_path_priorities(targets, parents, durations)
+    children = _children(targets, parents)
+    members = set(targets)
+    roots = [t for t in targets if not any(p in members for p in parents.get(t, []))]
+    path = [max(roots, key=priorities.__getitem__)]
+    while children[path[-1]]:
+        path.append(max(children[path[-1]], key=priorities.__getitem__))
+    return path
+
+
+def predict_makespan(
+    targets: List[str], parents: Dict[str, List[str]], durations: Dict[str, float], jobs: int
+) -> float:
+    """Simulates execute_graph() with the given durations and returns the total build time."""
+    priorities = critical_path_priorities(targets, parents, durations)
+    position = {target: index for index, target in enumerate(targets)}
+    children = _children(targets, parents)
+    waiting_for = {t: {p for p in parents.get(t, []) if p in position} for t in targets}
+
+    ready = [t for t in targets if not waiting_for[t]]
+    running: List[Tuple[float, int, str]] = []
+    now = 0.0
+    while ready or running:
+        ready.sort(key=lambda t: (-priorities[t], position[t]))
+        while ready and len(running) < jobs:
+            target = ready.pop(0)
+            heapq.heappush(running, (now + durations[target], position[target], target))
+        now, _, target = heapq.heappop(running)
+        for child in children[target]:
+            waiting_for[child].discard(target)
+            if not waiting_for[child]:
+                ready.append(child)
+    return now
+
+
+def execute_graph(
+    targets: List[str],
+    parents: Dict[str, List[str]],
+    jobs: int,
+    build: Callable[[str], bool],
+    durations: Optional[Dict[str, float]] = None,
+) -> Dict[str, str]:
+    """
+    Builds the targets with at most `jobs` concurrent `build` calls, starting each target as soon as its parents
+    succeeded. Ready targets on the critical path (according to `durations`) are started first, otherwise
+    they are started in the order of `targets`.
+
+    Returns the status (SUCCEEDED, FAILED or SKIPPED) of every target.
+    """
+    # Also fails early on dependency cycles
+    priorities = critical_path_priorities(targets, parents, durations or {t: 0.0 for t in targets})
+
+    position = {target: index for index, target in enumerate(targets)}
+    waiting_for = {t: {p for p in parents.get(t, []) if p in position} for t in targets}
+    children = _children(targets, parents)
+
+    status: Dict[str, str] = {}
+    ready = [t for t in targets if not waiting_for[t]]
+    running: Dict[Future, str] = {}
+
+    def skip_descendants(target: str) -> None:
+        for child in children[target]:
+            if child not in status:
+                status[child] = SKIPPED
+                skip_descendants(child)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while ready or running:
+            ready.sort(key=lambda t: (-priorities[t], position[t]))
+            while ready and len(running) < jobs:
+                target = ready.pop(0)
+                running[executor.submit(build, target)] = target
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                target = running.pop(future)
+                try:
+                    succeeded = future.result()
+                except Exception:
+                    logging.exception("Failed to build target [%s]", target)
+                    succeeded = False
+                status[target] = SUCCEEDED if succeeded else FAILED
+                if not succeeded:
+                    skip_descendants(target)
+                    continue
+                for child in children[target]:
+                    waiting_for[child].discard(target)
+                    if not waiting_for[child] and child not in status:
+                        ready.append(child)
+
+    return {target: status[target] for target in targets}
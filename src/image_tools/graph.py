@@ -0,0 +1,176 @@
+"""Products, targets and the dependencies between them.
+
+The graph is built once from the loaded configuration. Lookups by product or target name and
+walks along the dependencies go through its indexes, so that planning a build stays linear in
+the number of targets as the product matrix grows.
+
+A product version depends on another product if its version dictionary has an entry named
+after that product. Both are built by Bakefile targets, the dependency becomes a `contexts`
+entry of the dependent target.
+"""
+
+from typing import Callable, Collection, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+
+def bakefile_target_name_for_product_version(product_name: str, version: str) -> str:
+    """
+    Creates a normalized Bakefile target name for a given (product, version) combination.
+    """
+    return f"{product_name.replace('/', '_')}-{version.replace('.', '_')}"
+
+
+def dependency_order(
+    roots: Iterable[str], parents: Callable[[str], Iterable[str]], done: Collection[str] = ()
+) -> List[str]:
+    """
+    The roots and all their ancestors that are not `done`, each one after its parents. The dependencies are walked
+    with an explicit stack, so that long chains don't exceed the recursion limit. Raises a ValueError naming the
+    cycle if the dependencies have one.
+    """
+    order: List[str] = []
+    visited: Set[str] = set()
+    # The targets between the root and the target being walked, each one built on the next
+    path: List[str] = []
+    on_path: Set[str] = set()
+    for root in roots:
+        stack: List[Tuple[str, bool]] = [(root, False)]
+        while stack:
+            name, walked = stack.pop()
+            if walked:
+                on_path.remove(path.pop())
+                order.append(name)
+                continue
+            if name in visited or name in done:
+                continue
+            visited.add(name)
+            path.append(name)
+            on_path.add(name)
+            stack.append((name, True))
+            for parent in parents(name):
+                if parent in on_path:
+                    cycle = path[path.index(parent) :] + [parent]
+                    raise ValueError(f"Dependency cycle: {' -> '.join(cycle)}")
+                stack.append((parent, False))
+    return order
+
+
+class TargetNode:
+    """A product version and the Bakefile target that builds it."""
+
+    __slots__ = ("name", "product", "version", "parents", "children")
+
+    def __init__(self, name: str, product: str, version: str, parents: List[str]):
+        self.name = name
+        self.product = product
+        self.version = version
+        # Targets this target is built on, in the order of the version dictionary
+        self.parents = parents
+        # Targets built on this target, in the order of the configuration
+        self.children: List[str] = []
+
+    def __repr__(self) -> str:
+        return f"TargetNode({self.name})"
+
+
+class BuildGraph:
+    """Index of all targets of a configuration with forward and reverse dependencies."""
+
+    def __init__(self, nodes: Iterable[TargetNode]):
+        self.targets: Dict[str, TargetNode] = {}
+        self.products: Dict[str, List[TargetNode]] = {}
+        self._ancestors: Dict[str, FrozenSet[str]] = {}
+        for node in nodes:
+            self.targets[node.name] = node
+            self.products.setdefault(node.product, []).append(node)
+        for node in self.targets.values():
+            for parent in node.parents:
+                if parent in self.targets:
+                    self.targets[parent].children.append(node.name)
+
+    @classmethod
+    def from_conf(cls, conf) -> "BuildGraph":
+        product_names = {product["name"] for product in conf.products}
+        graph = cls(
+            TargetNode(
+                bakefile_target_name_for_product_version(product["name"], versions["product"]),
+                product["name"],
+                versions["product"],
+                [
+                    bakefile_target_name_for_product_version(name, version)
+                    for name, version in versions.items()
+                    if name in product_names
+                ],
+            )
+            for product in conf.products
+            for versions in product.get("versions", [])
+        )
+        # Products without versions can still be selected
+        for name in product_names:
+            graph.products.setdefault(name, [])
+        return graph
+
+    def parents(self, target: str) -> List[str]:
+        node = self.targets.get(target)
+        return node.parents if node else []
+
+    def children(self, target: str) -> List[str]:
+        node = self.targets.get(target)
+        return node.children if node else []
+
+    def ancestors(self, target: str) -> FrozenSet[str]:
+        """All targets that must be built before the given target. Computed once per target."""
+        for name in dependency_order([target], self.parents, self._ancestors):
+            result: Set[str] = set()
+            for parent in self.parents(name):
+                result.add(parent)
+                result |= self._ancestors[parent]
+            self._ancestors[name] = frozenset(result)
+        return self._ancestors[target]
+
+    def descendants(self, target: str) -> Set[str]:
+        """All targets that are built on top of the given target, directly or indirectly."""
+        result: Set[str] = set()
+        pending = list(self.children(target))
+        while pending:
+            child = pending.pop()
+            if child not in result:
+                result.add(child)
+                pending.extend(self.children(child))
+        return result
+
+    def with_dependents(self, targets: List[str]) -> List[str]:
+        """The targets followed by all targets that depend on them, in the order of the configuration."""
+        selected = set(targets)
+        dependents = set().union(*(self.descendants(target) for target in targets)) - selected
+        return targets + [name for name in self.targets if name in dependents]
+
+    def product_for_path(self, path: str) -> Optional[str]:
+        """The product whose directory contains the path, e.g. `opa` for `opa/stackable/patches/0.51.0.patch`."""
+        parts = path.split("/")
+        for length in range(len(parts) - 1, 0, -1):
+            name = "/".join(parts[:length])
+            if name in self.products:
+                return name
+        return None
+
+    def select(self, selectors: List[str]) -> List[str]:
+        """
+        Targets for product selectors such as `opa` (all versions) or `opa=0.51.0` (one version). Without
+        selectors, all targets are selected.
+        """
+        if not selectors:
+            return list(self.targets)
+        targets: List[str] = []
+        for selector in selectors:
+            product_name, *versions = selector.split("=")
+            nodes = self.products.get(product_name)
+            if nodes is None:
+                raise ValueError(f"Requested unknown product [{product_name}]")
+            if not versions:
+                targets.extend(node.name for node in nodes)
+            for version in versions:
+                target = bakefile_target_name_for_product_version(product_name, version)
+                if target not in self.targets:
+                    raise ValueError(f"Requested unknown version [{version}] of product [{product_name}]")
+                targets.append(target)
+        return targets
@@ -0,0 +1,189 @@
+"""Content hashes of the build inputs of Bakefile targets.
+
+The input hash of a target covers its Containerfile, the product directory, the files
+copied into the image, the build arguments and the input hashes of the targets it uses
+as build contexts. It is recorded as an image label so later builds can skip targets
+whose published image was built from the same inputs.
+"""
+
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import CalledProcessError, run
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .graph import dependency_order
+
+INPUT_HASH_LABEL = "tech.stackable.input-hash"
+
+# Number of concurrent registry queries when looking up published input hashes.
+REGISTRY_QUERY_WORKERS = 8
+
+_ARG_REFERENCE = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)\}?")
+
+
+def dockerfile_sources(dockerfile: str, build_args: Dict[str, str]) -> List[str]:
+    """
+    Source paths of the COPY and ADD instructions of a Containerfile that read from the build context.
+
+    Instructions copying from other stages or images (`--from`) and remote URLs are ignored.
+    Build argument references are substituted with the given build arguments.
+    """
+    sources = []
+    instruction = ""
+    for line in dockerfile.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            continue
+        if stripped.endswith("\\"):
+            instruction += stripped[:-1] + " "
+            continue
+        instruction += stripped
+        words = instruction.split(maxsplit=1)
+        instruction = ""
+        if len(words) != 2 or words[0].upper() not in ("COPY", "ADD"):
+            continue
+        arguments = words[1].strip()
+        if arguments.startswith("["):
+            paths = json.loads(arguments)
+        else:
+            paths = shlex.split(arguments)
+            while paths and paths[0].startswith("--"):
+                if paths[0].startswith("--from"):
+                    paths = []
+                    break
+                paths = paths[1:]
+        for path in paths[:-1]:
+            if "://" in path or path.startswith("<<"):
+                continue
+            sources.append(_ARG_REFERENCE.sub(lambda m: build_args.get(m.group(1), m.group(0)), path))
+    return sources
+
+
+def target_sources(bakefile: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    The product directory and the COPY and ADD sources of each target of the Bakefile, relative to its build context.
+    """
+    result = {}
+    for name, target in bakefile["target"].items():
+        with open(os.path.join(target.get("context", "."), target["dockerfile"]), encoding="utf-8") as f:
+            sources = dockerfile_sources(f.read(), target.get("args", {}))
+        result[name] = [os.path.normpath(p) for p in [os.path.dirname(target["dockerfile"]), *sources]]
+    return result
+
+
+def is_source(path: str, sources: List[str]) -> bool:
+    """Whether the path is one of the sources, inside one of the source directories or matches a source pattern."""
+    return any(path == s or path.startswith(f"{s}/") or fnmatch.fnmatch(path, s) for s in sources)
+
+
+def _hash_file(digest: Any, root: str, path: str) -> None:
+    digest.update(path.encode("utf-8"))
+    with open(os.path.join(root, path), "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+
+def hash_paths(root: str, paths: List[str]) -> str:
+    """Hash of the names and contents of the given files, directories and glob patterns relative to `root`."""
+    files: Set[str] = set()
+    for pattern in paths:
+        for path in glob.glob(os.path.join(root, pattern), recursive=True):
+            if os.path.isdir(path):
+                for dirpath, _, names in os.walk(path):
+                    files.update(os.path.join(dirpath, name) for name in names)
+            elif os.path.isfile(path):
+                files.add(path)
+    digest = hashlib.sha256()
+    for path in sorted(os.path.relpath(f, root) for f in files):
+        _hash_file(digest, root, path)
+    return digest.hexdigest()
+
+
+def target_input_hashes(bakefile: Dict[str, Any]) -> Dict[str, str]:
+    """Merkle-style input hashes for all targets of the Bakefile."""
+    result: Dict[str, str] = {}
+
+    def parents(name: str) -> List[str]:
+        contexts = bakefile["target"][name].get("contexts", {})
+        return [value[len("target:") :] for value in contexts.values() if value.startswith("target:")]
+
+    # Parents come first, so that their hashes are known when the hash of a target is computed
+    for name in dependency_order(bakefile["target"], parents):
+        target = bakefile["target"][name]
+        context = target.get("context", ".")
+        with open(os.path.join(context, target["dockerfile"]), encoding="utf-8") as f:
+            dockerfile = f.read()
+        sources = dockerfile_sources(dockerfile, target.get("args", {}))
+        inputs = {
+            "dockerfile": dockerfile,
+            "files": hash_paths(context, [os.path.dirname(target["dockerfile"]), *sources]),
+            # The reproducible build timestamp changes with every commit and is not an input of its own
+            "args": {k: v for k, v in target.get("args", {}).items() if k != "SOURCE_DATE_EPOCH"},
+            "platforms": target.get("platforms", []),
+            "parents": {
+                key: result[value[len("target:") :]] if value.startswith("target:") else value
+                for key, value in sorted(target.get("contexts", {}).items())
+            },
+        }
+        result[name] = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+    return result
+
+
+def add_input_hash_labels(bakefile: Dict[str, Any], hashes: Dict[str, str]) -> None:
+    """Record the input hash of each target as image label and annotation."""
+    for name, target in bakefile["target"].items():
+        target.setdefault("labels", {})[INPUT_HASH_LABEL] = hashes[name]
+        target.setdefault("annotations", []).append(f"{INPUT_HASH_LABEL}={hashes[name]}")
+
+
+def published_input_hash(image: str, platform: str) -> Optional[str]:
+    """The input hash label of a published image, or None if the image or label doesn't exist."""
+    try:
+        result = run(
+            ["docker", "buildx", "imagetools", "inspect", image, "--format", "{{json .Image}}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        config = json.loads(result.stdout)
+    except (CalledProcessError, FileNotFoundError, json.JSONDecodeError):
+        return None
+    # Image indexes return one configuration per platform
+    if platform in config:
+        config = config[platform]
+    return ((config or {}).get("config", {}).get("Labels") or {}).get(INPUT_HASH_LABEL)
+
+
+def skip_unchanged_targets(
+    bakefile: Dict[str, Any], targets: List[str], hashes: Dict[str, str]
+) -> Tuple[List[str], List[str]]:
+    """
+    Drop targets whose published image was built from the same inputs.
+
+    All targets of the Bakefile are looked up in the registry. Build contexts that refer to an
+    unchanged target are rewritten to use the published image instead of rebuilding it.
+    Returns the remaining and the skipped targets.
+    """
+
+    def is_unchanged(name: str) -> bool:
+        target = bakefile["target"][name]
+        platform = (target.get("platforms") or ["linux/amd64"])[0]
+        return published_input_hash(target["tags"][0], platform) == hashes[name]
+
+    names = list(bakefile["target"].keys())
+    with ThreadPoolExecutor(max_workers=REGISTRY_QUERY_WORKERS) as executor:
+        unchanged = {name for name, same in zip(names, executor.map(is_unchanged, names)) if same}
+
+    for target in bakefile["target"].values():
+        for key, value in target.get("contexts", {}).items():
+            parent = value[len("target:") :] if value.startswith("target:") else None
+            if parent in unchanged:
+                target["contexts"][key] = f"docker-image://{bakefile['target'][parent]['tags'][0]}"
+
+    return [t for t in targets if t not in unchanged], [t for t in targets if t in unchanged]
@@ -1,7 +1,16 @@
 """Library code for image tools."""
 
+import os
+import sys
+import tempfile
+from collections import deque
 from dataclasses import dataclass, field
-from typing import List, Optional
+from subprocess import PIPE, Popen
+from typing import List, Optional, Tuple
+
+# Files are created with the permissions `open` would give them, not the private ones of temporary files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
 @dataclass(frozen=True)
@@ -24,3 +33,36 @@ class Command:
             return f"{' '.join(self.args)} <<<EOF\n{self.stdin}\nEOF;"
         else:
             return " ".join(self.args)
+
+
+def write_atomic(path: str, content: str) -> None:
+    """
+    Replaces the file with the content, so that readers never see a partially written file. Each writer uses a temporary
+    file of its own, so that concurrent writers of the same file don't overwrite each other's temporary file.
+    """
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", delete=False
+    ) as f:
+        f.write(content)
+        os.chmod(f.name, 0o666 & ~_UMASK)
+    try:
+        os.replace(f.name, path)
+    except OSError:
+        os.unlink(f.name)
+        raise
+
+
+def run_and_capture(args: List[str], stdin: Optional[str] = None, tail: int = 200) -> Tuple[int, str]:
+    """
+    Runs a program and passes its standard error through, keeping the last `tail` lines of it
+    so that failures can be inspected. Returns the exit code and the captured lines.
+    """
+    lines: deque = deque(maxlen=tail)
+    with Popen(args, stdin=PIPE, stderr=PIPE, text=True) as process:
+        if process.stdin:
+            process.stdin.write(stdin or "")
+            process.stdin.close()
+        for line in process.stderr or []:
+            sys.stderr.write(line)
+            lines.append(line)
+    return process.returncode, "".join(lines)
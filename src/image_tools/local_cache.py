@@ -0,0 +1,155 @@
+"""Build cache directories on the local disk, managed by bake.
+
+BuildKit's `type=local` cache exporter adds blobs to the destination directory but never removes
+any, so a directory that is exported to again and again grows without limit. Instead, every build
+exports the cache of a target to a new directory. After the build, that directory replaces the
+previous cache of the target and the least recently used caches are removed until all of them fit
+into the configured size.
+
+The cache of a target is a symbolic link `<target>-<arch>` to the directory holding its current
+version, so that replacing it is atomic for concurrent builds that read it.
+"""
+
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Union
+
+# Leftovers of interrupted builds are removed once they are older than this
+STALE_SECONDS = 24 * 60 * 60
+
+_UNITS = {"": 1, "K": 1000, "M": 1000**2, "G": 1000**3, "T": 1000**4}
+_SIZE = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMGT]?)(i?)B?$", re.IGNORECASE)
+
+
+def parse_size(value: Union[int, str]) -> int:
+    """
+    Parses a size in bytes with an optional decimal or binary unit.
+
+    >>> parse_size("50GiB")
+    53687091200
+    >>> parse_size("1.5G")
+    1500000000
+    """
+    if isinstance(value, int):
+        return value
+    match = _SIZE.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    number, unit, binary = match.groups()
+    factor = 1024 ** list(_UNITS).index(unit.upper()) if binary else _UNITS[unit.upper()]
+    return int(float(number) * factor)
+
+
+def cache_source(directory: str, target: str, arch: str) -> str:
+    """The current cache of the target, imported with `cache-from`."""
+    return os.path.join(directory, f"{target}-{arch.replace('/', '_')}")
+
+
+def cache_destination(directory: str, target: str, arch: str) -> str:
+    """The directory the cache of the target is exported to by this bake process."""
+    return f"{cache_source(directory, target, arch)}.{os.getpid()}.new"
+
+
+def is_complete(path: str) -> bool:
+    """BuildKit writes the index of a local cache after all blobs were written."""
+    return os.path.isfile(os.path.join(path, "index.json"))
+
+
+def commit(directory: str, target: str, arch: str) -> bool:
+    """
+    Replaces the cache of the target with the one exported by this process, if the export is complete.
+    Returns whether the cache was replaced.
+    """
+    source = cache_source(directory, target, arch)
+    destination = cache_destination(directory, target, arch)
+    if not is_complete(destination):
+        shutil.rmtree(destination, ignore_errors=True)
+        if os.path.islink(source) and os.path.exists(source):
+            # The cache was used, which counts for the eviction
+            touch(os.path.realpath(source))
+        return False
+
+    previous = os.path.realpath(source) if os.path.islink(source) else None
+    version = f"{source}.{uuid.uuid4().hex[:12]}"
+    os.rename(destination, version)
+    touch(version)
+    link = f"{version}.link"
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, source)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+    return True
+
+
+def touch(path: str) -> None:
+    """Marks the cache as used. The file system clock can be too coarse to order consecutive builds."""
+    now = time.time()
+    os.utime(path, (now, now))
+
+
+def directory_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def evict(directory: str, max_size: int) -> List[str]:
+    """
+    Removes the least recently used caches until the remaining ones take at most `max_size` bytes, as well as
+    stale leftovers of interrupted builds. Returns the names of the removed caches.
+    """
+    if not os.path.isdir(directory):
+        return []
+    entries = list(os.scandir(directory))
+    links = {entry.path: os.path.realpath(entry.path) for entry in entries if entry.is_symlink()}
+
+    referenced = set(links.values())
+    now = time.time()
+    for entry in entries:
+        if (
+            entry.is_dir(follow_symlinks=False)
+            and os.path.realpath(entry.path) not in referenced
+            and entry.stat(follow_symlinks=False).st_mtime < now - STALE_SECONDS
+        ):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    caches = sorted(
+        (os.path.getmtime(version), link, version, directory_size(version))
+        for link, version in links.items()
+        if os.path.isdir(version)
+    )
+    total = sum(size for *_, size in caches)
+    removed = []
+    for _, link, version, size in caches:
+        if total <= max_size:
+            break
+        os.unlink(link)
+        shutil.rmtree(version, ignore_errors=True)
+        total -= size
+        removed.append(os.path.basename(link))
+    return removed
+
+
+def commit_local_caches(cache: List[Dict[str, Any]], targets: List[str], arch: str) -> List[str]:
+    """
+    Commits the caches exported for the targets to all managed local back ends (back ends of type `local` with a
+    `directory`) and evicts caches from those with a `max_size`. Returns the names of the evicted caches.
+    """
+    removed = []
+    for backend in cache:
+        if backend.get("type") != "local" or "directory" not in backend:
+            continue
+        os.makedirs(backend["directory"], exist_ok=True)
+        for target in targets:
+            commit(backend["directory"], target, arch)
+        if "max_size" in backend:
+            removed.extend(evict(backend["directory"], parse_size(backend["max_size"])))
+    return removed
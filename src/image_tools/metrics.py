@@ -0,0 +1,184 @@
+"""Per-target build metrics from the buildx progress stream.
+
+When `docker buildx bake` runs with `--progress=rawjson`, it writes one BuildKit solve status
+per line to stderr. Each status lists build steps (vertices) with their start and completion
+times and whether they were cached, plus progress updates such as pushed bytes. When a bake call
+builds more than one target, vertex names are prefixed with the Bakefile target they belong to,
+e.g. `[opa-0_51_0 builder 3/7] RUN ...`. Calls with a single target have no prefixes.
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from subprocess import PIPE, Popen
+from typing import Any, Dict, List, Optional, Tuple
+
+from .lib import Command, write_atomic
+
+# Number of slowest executed steps reported per target.
+SLOWEST_STEPS = 5
+
+_TARGET_PREFIX = re.compile(r"^\[([^\s\]]+)")
+_TIMESTAMP = re.compile(r"^(.*T\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parses the RFC 3339 timestamps of BuildKit, which have nanosecond precision."""
+    match = _TIMESTAMP.match(value)
+    if not match:
+        raise ValueError(f"Invalid timestamp: {value}")
+    base, fraction, zone = match.groups()
+    fraction = (fraction or "0")[:6].ljust(6, "0")
+    return datetime.fromisoformat(f"{base}.{fraction}{'+00:00' if zone == 'Z' else zone}")
+
+
+@dataclass
+class Vertex:
+    name: str
+    target: Optional[str]
+    started: Optional[datetime] = None
+    completed: Optional[datetime] = None
+    cached: bool = False
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started and self.completed:
+            return (self.completed - self.started).total_seconds()
+        return 0.0
+
+
+@dataclass
+class BuildMetrics:
+    """Collects the vertices and push progress of a bake run, grouped by target."""
+
+    targets: List[str]
+    # All targets of the Bakefile, including the ones that are only built as build context of the targets
+    bakefile_targets: List[str] = field(default_factory=list)
+    vertices: Dict[str, Vertex] = field(default_factory=dict)
+    pushed: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    # Lines that are not part of the progress stream, such as the final error message of buildx
+    messages: deque = field(default_factory=lambda: deque(maxlen=200))
+
+    def target_of(self, vertex_name: str) -> Optional[str]:
+        match = _TARGET_PREFIX.match(vertex_name)
+        prefix = match.group(1) if match else None
+        if prefix in self.targets:
+            return prefix
+        # buildx only prefixes the vertices with the target when more than one target is built
+        if len(self.targets) == 1 and prefix not in self.bakefile_targets:
+            return self.targets[0]
+        return None
+
+    def feed(self, line: str) -> List[Vertex]:
+        """Processes a line of the progress stream and returns the vertices it completed."""
+        try:
+            status = json.loads(line)
+        except json.JSONDecodeError:
+            self.messages.append(line)
+            return []
+        completed = []
+        for v in status.get("vertexes") or []:
+            vertex = self.vertices.setdefault(v["digest"], Vertex(v.get("name", ""), self.target_of(v.get("name", ""))))
+            vertex.cached = vertex.cached or v.get("cached", False)
+            vertex.error = v.get("error") or vertex.error
+            if v.get("started"):
+                vertex.started = parse_timestamp(v["started"])
+            if v.get("completed") and not vertex.completed:
+                vertex.completed = parse_timestamp(v["completed"])
+                completed.append(vertex)
+        for s in status.get("statuses") or []:
+            pushing = self.vertices.get(s.get("vertex", ""))
+            if pushing and pushing.target and s.get("id", "").startswith("pushing") and s.get("total"):
+                self.pushed[(pushing.target, s["id"])] = s["total"]
+        return completed
+
+    def errors(self) -> str:
+        """Errors of failed build steps and the messages outside of the progress stream."""
+        return "".join([f"{v.name}: {v.error}\n" for v in self.vertices.values() if v.error] + list(self.messages))
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Wall time, cached and executed steps, slowest steps, pushed bytes and image digest for each target."""
+        result = {}
+        for target in self.targets:
+            vertices = [v for v in self.vertices.values() if v.target == target]
+            if not vertices:
+                continue
+            started = [v.started for v in vertices if v.started]
+            completed = [v.completed for v in vertices if v.completed]
+            executed = [v for v in vertices if not v.cached]
+            result[target] = {
+                "duration_seconds": (max(completed) - min(started)).total_seconds() if started and completed else 0.0,
+                "cached_steps": len(vertices) - len(executed),
+                "executed_steps": len(executed),
+                "failed_steps": sum(1 for v in vertices if v.error),
+                "slowest_steps": [
+                    {"name": v.name, "duration_seconds": v.duration}
+                    for v in sorted(executed, key=lambda v: v.duration, reverse=True)[:SLOWEST_STEPS]
+                ],
+                "pushed_bytes": sum(size for (t, _), size in self.pushed.items() if t == target),
+                "digest": self.metadata.get(target, {}).get("containerimage.digest"),
+            }
+        return result
+
+
+def run_with_metrics(cmd: Command, targets: List[str]) -> Tuple[int, BuildMetrics]:
+    """
+    Runs the bake command with the rawjson progress output and a metadata file and collects metrics
+    while the build is running. A line is printed to stderr for each completed step and for each
+    line that is not part of the progress stream.
+    """
+    metrics = BuildMetrics(targets, list(json.loads(cmd.stdin)["target"]) if cmd.stdin else [])
+    with tempfile.TemporaryDirectory() as tmp:
+        metadata_file = os.path.join(tmp, "metadata.json")
+        args = [*cmd.args, "--progress=rawjson", "--metadata-file", metadata_file]
+        with Popen(args, stdin=PIPE, stderr=PIPE, text=True) as bake:
+            if bake.stdin:
+                bake.stdin.write(cmd.stdin or "")
+                bake.stdin.close()
+            for line in bake.stderr or []:
+                if not line.startswith("{"):
+                    sys.stderr.write(line)
+                for vertex in metrics.feed(line):
+                    state = "CACHED" if vertex.cached else f"{vertex.duration:.1f}s"
+                    print(f"{vertex.name} {'ERROR' if vertex.error else state}", file=sys.stderr)
+        metrics.metadata = read_metadata_file(metadata_file)
+    return bake.returncode, metrics
+
+
+def read_metadata_file(path: str) -> Dict[str, Any]:
+    """Reads the file written by `docker buildx bake --metadata-file`. It is missing if the build failed early."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json_report(path: str, report: Dict[str, Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+def write_prometheus_textfile(path: str, report: Dict[str, Dict[str, Any]]) -> None:
+    """Writes the report in the Prometheus text format, e.g. for the node exporter textfile collector."""
+    metrics = [
+        ("bake_target_duration_seconds", "Wall time of the target build.", "duration_seconds"),
+        ("bake_target_cached_steps", "Number of build steps served from the cache.", "cached_steps"),
+        ("bake_target_executed_steps", "Number of build steps that were executed.", "executed_steps"),
+        ("bake_target_failed_steps", "Number of build steps that failed.", "failed_steps"),
+        ("bake_target_pushed_bytes", "Number of bytes pushed to the registry.", "pushed_bytes"),
+    ]
+    lines = []
+    for name, description, key in metrics:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f'{name}{{target="{target}"}} {values[key]}' for target, values in report.items())
+    # The textfile collector may read the file at any time, so it must be replaced atomically
+    write_atomic(path, "\n".join(lines) + "\n")
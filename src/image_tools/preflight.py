@@ -1,6 +1,6 @@
 """OpenShift image validation
 
-Run RedHat's preflight command on images for a product.
+Run RedHat's preflight command on images for one or more products and architectures.
 
 Requirements:
 * openshift-preflight. See: https://github.com/redhat-openshift-ecosystem/openshift-preflight
@@ -8,10 +8,13 @@ Requirements:
 Usage:
 
     python -m image_tools.preflight -p opa -i 23.1.0
+    python -m image_tools.preflight -p opa -p druid -a linux/amd64 -a linux/arm64 -i 23.1.0
 """
 
 from argparse import Namespace
-from typing import List, Dict, Any
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple, TypeVar
 import subprocess
 import json
 import sys
@@ -20,43 +23,88 @@ import logging
 from .args import preflight_args, load_configuration
 from .lib import Command
 from .bake import generate_bakefile
+from .graph import BuildGraph
+from .preflight_cache import PreflightCache, preflight_version, resolve_digest
 
+K = TypeVar("K")
 
-def get_images_for_target(product: str, bakefile: Dict[str, Any]) -> List[str]:
-    tags = []
 
-    for target in bakefile.get("group", {}).get(product, {}).get("targets", []):
-        tags.extend(get_images_for_target(target, bakefile))
+class PreflightCheck(NamedTuple):
+    """A product image to be checked for a single architecture."""
 
-    tags.extend(bakefile["target"].get(product, {}).get("tags", []))
+    product: str
+    image: str
+    architecture: str
 
-    return tags
+    def __str__(self) -> str:
+        return f"{self.image} ({self.architecture})"
 
 
-def get_preflight_failures(image_commands: Dict[str, Command]) -> Dict[str, List[Any]]:
-    """Run preflight commands for each image and return the failure field of the response."""
-    failures = {}
-    for image, cmd in image_commands.items():
-        try:
-            preflight_result = subprocess.run(cmd.args, input=cmd.input, check=True, stdout=subprocess.PIPE)
-            preflight_json = json.loads(preflight_result.stdout)
-            failures[image] = preflight_json.get("results", {}).get("failed", [])
-        except subprocess.CalledProcessError as error:
-            failures[image] = [error.stderr.decode("utf-8")]
-        except FileNotFoundError:
-            failures[image] = [
-                "preflight: command not found. Install from https://github.com/redhat-openshift-ecosystem/openshift-preflight"
-            ]
-        except json.JSONDecodeError as error:
-            failures[image] = [error.msg]
-    return failures
+def get_images_for_target(product: str, bakefile: Dict[str, Any], graph: BuildGraph) -> List[str]:
+    """Image tags of all targets selected by `product`, e.g. `opa` or `opa=0.51.0`."""
+    try:
+        targets = graph.select([product])
+    except ValueError:
+        return []
+    return [tag for target in targets for tag in bakefile["target"][target]["tags"]]
 
 
-def preflight_commands(images: List[str], args: Namespace, conf) -> Dict[str, Command]:
-    """A mapping of image name to preflight command"""
+def run_preflight(cmd: Command, timeout: Optional[float] = None) -> List[Any]:
+    """Run a single preflight command and return the failure field of the response."""
+    try:
+        preflight_result = subprocess.run(
+            cmd.args, input=cmd.input, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout
+        )
+        preflight_json = json.loads(preflight_result.stdout)
+        return preflight_json.get("results", {}).get("failed", [])
+    except subprocess.CalledProcessError as error:
+        return [error.stderr.decode("utf-8")]
+    except subprocess.TimeoutExpired:
+        return [f"preflight: timed out after {timeout} seconds"]
+    except FileNotFoundError:
+        return [
+            "preflight: command not found. Install from https://github.com/redhat-openshift-ecosystem/openshift-preflight"
+        ]
+    except json.JSONDecodeError as error:
+        return [error.msg]
+
+
+def get_preflight_failures(
+    image_commands: Dict[K, Command], jobs: int = 1, timeout: Optional[float] = None
+) -> Dict[K, List[Any]]:
+    """
+    Run preflight commands for each image and return the failure field of the response.
+
+    Up to `jobs` commands run concurrently. The result keeps the order of `image_commands`.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {image: executor.submit(run_preflight, cmd, timeout) for image, cmd in image_commands.items()}
+        return {image: future.result() for image, future in futures.items()}
+
+
+def preflight_checks(
+    args: Namespace, bakefile: Dict[str, Any], graph: BuildGraph
+) -> Tuple[List[PreflightCheck], List[str]]:
+    """The product × architecture matrix of images to check and the products without any images."""
+    result: List[PreflightCheck] = []
+    missing: List[str] = []
+    for product in args.product:
+        # List of images (with tags) to apply preflight checks to.
+        # Filter out images with platform release tags such as "23.4" and
+        # only check images with patch versions such as "23.4.0".
+        images = [i for i in get_images_for_target(product, bakefile, graph) if i.endswith(args.image_version)]
+        if not images:
+            logging.error("No images found for product [%s]", product)
+            missing.append(product)
+        result.extend(PreflightCheck(product, img, arch) for img in images for arch in args.architectures)
+    return result, missing
+
+
+def preflight_commands(checks: List[PreflightCheck], args: Namespace, conf) -> Dict[PreflightCheck, Command]:
+    """A mapping of preflight check to preflight command"""
     result = {}
-    for img in images:
-        cmd_args = [args.executable, "check", "container", img]
+    for check in checks:
+        cmd_args = [args.executable, "check", "container", check.image]
         if args.submit:
             cmd_args.extend(
                 [
@@ -66,22 +114,58 @@ def preflight_commands(images: List[str], args: Namespace, conf) -> Dict[str, Co
                     "--pyxis-api-token",
                     args.token,
                     "--certification-project-id",
-                    f"ospid-{conf.open_shift_projects[args.product]['id']}",
-                ]
-            )
-        if args.architecture:
-            cmd_args.extend(
-                [
-                    "--platform",
-                    # this argument value has already been checked against valid values with an expected prefix.
-                    # Preflight provides the same "linux/" prefix and so it must be removed here.
-                    args.architecture.split("linux/")[1],
+                    f"ospid-{conf.open_shift_projects[check.product]['id']}",
                 ]
             )
-        result[img] = Command(args=cmd_args)
+        cmd_args.extend(
+            [
+                "--platform",
+                # this argument value has already been checked against valid values with an expected prefix.
+                # Preflight provides the same "linux/" prefix and so it must be removed here.
+                check.architecture.split("linux/")[1],
+            ]
+        )
+        result[check] = Command(args=cmd_args)
     return result
 
 
+def preflight_cache_keys(checks: List[PreflightCheck], args: Namespace) -> Dict[PreflightCheck, str]:
+    """Cache keys of the checks whose image digest and preflight version could be determined."""
+    version = preflight_version(args.executable)
+    if version is None:
+        return {}
+    images = list(dict.fromkeys(check.image for check in checks))
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        digests = dict(zip(images, executor.map(resolve_digest, images)))
+    return {
+        check: PreflightCache.key(digest, version, check.architecture, args.submit)
+        for check in checks
+        if (digest := digests[check.image])
+    }
+
+
+def print_report(
+    checks: List[PreflightCheck], failures: Dict[PreflightCheck, List[Any]], cached: Dict[PreflightCheck, List[Any]]
+) -> None:
+    """Log the result of every check followed by a summary per product and architecture."""
+    summary: Dict[Tuple[str, str], Counter] = {}
+    for check in checks:
+        img_fails = failures[check]
+        if check in cached:
+            logging.info("Image [%s] preflight check successful (cached result).", check)
+        elif len(img_fails) == 0:
+            logging.info("Image [%s] preflight check successful.", check)
+        else:
+            logging.error("Image [%s] preflight check failures: %s", check, ",".join(img_fails))
+        summary.setdefault((check.product, check.architecture), Counter())["failed" if img_fails else "passed"] += 1
+
+    for (product, architecture), counts in summary.items():
+        log = logging.error if counts["failed"] else logging.info
+        log(
+            "Product [%s] (%s): %d images passed, %d failed.", product, architecture, counts["passed"], counts["failed"]
+        )
+
+
 def main() -> int:
     """Run OpenShift verification checks against the product images."""
     logging.basicConfig(
@@ -94,39 +178,48 @@ def main() -> int:
 
     conf = load_configuration(args.configuration)
 
-    bakefile = generate_bakefile(args, conf)
+    graph = BuildGraph.from_conf(conf)
+    bakefile = generate_bakefile(args, conf, graph)
 
-    # List of images (with tags) to apply preflight checks to.
-    # Filter out images with platform release tags such as "23.4" and
-    # only check images with patch versions such as "23.4.0".
-    images = list(
-        filter(
-            lambda i: i.endswith(args.image_version),
-            get_images_for_target(args.product, bakefile),
-        )
-    )
-    if not images:
-        logging.error("No images found for product [%s]", args.product)
+    # Products without images count as failures, e.g. a misspelled product name
+    checks, missing = preflight_checks(args, bakefile, graph)
+    if not checks:
         return 1
 
-    # A mapping of image name to preflight command
-    image_commands = preflight_commands(images, args, conf)
+    # A mapping of preflight check to preflight command
+    image_commands = preflight_commands(checks, args, conf)
 
     if args.dry:
         for _, cmd in image_commands.items():
             logging.info(str(cmd))
-        return 0
+        return len(missing)
+
+    # Images whose digest was already checked successfully are not checked again
+    preflight_cache = PreflightCache(args.cache_dir)
+    cache_keys: Dict[PreflightCheck, str] = {}
+    cached: Dict[PreflightCheck, List[Any]] = {}
+    if not args.no_cache:
+        preflight_cache.evict()
+        cache_keys = preflight_cache_keys(checks, args)
+        for check, key in cache_keys.items():
+            entry = preflight_cache.get(key)
+            if entry is not None:
+                cached[check] = entry["failures"]
 
     # Run preflight and return failures
-    failures = get_preflight_failures(image_commands)
+    failures = get_preflight_failures(
+        {check: cmd for check, cmd in image_commands.items() if check not in cached}, args.jobs, args.timeout
+    )
 
-    for image, img_fails in failures.items():
-        if len(img_fails) == 0:
-            logging.info("Image [%s] preflight check successful.", image)
-        else:
-            logging.error("Image [%s] preflight check failures: %s", image, ",".join(img_fails))
+    for check, img_fails in failures.items():
+        if len(img_fails) == 0 and check in cache_keys:
+            preflight_cache.put(cache_keys[check], check.image, img_fails)
+
+    failures.update(cached)
+
+    print_report(checks, failures, cached)
 
-    fail_count = sum(map(len, failures.values()))
+    fail_count = sum(map(len, failures.values())) + len(missing)
     return fail_count
 
 
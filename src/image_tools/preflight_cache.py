@@ -0,0 +1,97 @@
+"""On-disk cache of successful preflight results.
+
+Entries are keyed by image digest, preflight version, platform and whether the results were
+submitted, so a re-tagged but otherwise identical image is not checked twice. Resolving a tag
+to its digest only needs the image manifest, while preflight pulls and unpacks the whole image.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from functools import cache
+from subprocess import CalledProcessError, run
+from typing import Any, Dict, List, Optional
+
+from .lib import write_atomic
+
+# Entries older than this are removed.
+MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+# If there are more entries, the oldest ones are removed.
+MAX_ENTRIES = 1000
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "image-tools", "preflight")
+
+
+def resolve_digest(image: str) -> Optional[str]:
+    """Returns the digest of the manifest (or index) the image tag points to, or None if it can't be resolved."""
+    try:
+        result = run(
+            ["docker", "buildx", "imagetools", "inspect", image, "--format", "{{json .Manifest}}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return json.loads(result.stdout).get("digest")
+    except (CalledProcessError, FileNotFoundError, json.JSONDecodeError) as e:
+        logging.warning("Failed to resolve digest of image [%s]: %s", image, e)
+        return None
+
+
+@cache
+def preflight_version(executable: str) -> Optional[str]:
+    try:
+        result = run([executable, "--version"], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (CalledProcessError, FileNotFoundError):
+        return None
+
+
+class PreflightCache:
+    """Successful preflight results stored as one JSON file per entry."""
+
+    def __init__(self, directory: str, max_age: float = MAX_AGE_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(digest: str, version: str, platform: str, submitted: bool) -> str:
+        return hashlib.sha256(f"{digest}|{version}|{platform}|{submitted}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, image: str, failures: List[Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(self._path(key), json.dumps({"image": image, "failures": failures, "created": time.time()}))
+
+    def evict(self) -> None:
+        """Removes entries older than `max_age` and the oldest entries beyond `max_entries`."""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".json"):
+                entries.append((os.path.getmtime(path), path))
+        entries.sort(reverse=True)
+        now = time.time()
+        for index, (mtime, path) in enumerate(entries):
+            if index >= self.max_entries or now - mtime > self.max_age:
+                os.remove(path)
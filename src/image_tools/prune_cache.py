@@ -0,0 +1,95 @@
+"""Branch specific build cache clean up
+
+Deletes the cache refs written by the builds of a branch from the registries of all
+`branch_scoped` cache back ends, e.g. after the pull request of the branch was merged.
+
+Requirements: skopeo (https://github.com/containers/skopeo). The registry must allow deleting manifests.
+
+Usage:
+
+    python -m image_tools.prune_cache --branch feat/opa-1.0
+"""
+
+import json
+import re
+import sys
+from subprocess import CalledProcessError, run
+from typing import List
+
+from .args import load_configuration, prune_cache_args
+from .bake import bakefile_target_name_for_product_version, branch_scope
+from .version import version
+
+
+def branch_cache_tags(tags: List[str], targets: List[str], scope: str) -> List[str]:
+    """
+    Returns the cache tags of the given branch scope. The tags have the form `<target>-<arch>-<scope>`, the
+    target names are matched exactly so that the cache of a branch `opa` is not confused with one of `feat-opa`.
+    """
+    if not targets:
+        return []
+    pattern = re.compile(rf"^(?:{'|'.join(re.escape(t) for t in targets)})-[^-]+-{re.escape(scope)}$")
+    return [tag for tag in tags if pattern.match(tag)]
+
+
+def list_tags(repository: str) -> List[str]:
+    result = run(["skopeo", "list-tags", f"docker://{repository}"], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout).get("Tags") or []
+
+
+def main() -> int:
+    args = prune_cache_args()
+
+    if args.version:
+        print(version())
+        return 0
+
+    conf = load_configuration(args.configuration)
+    targets = [
+        bakefile_target_name_for_product_version(product["name"], version_dict["product"])
+        for product in conf.products
+        for version_dict in product.get("versions", [])
+    ]
+
+    backends = [b for b in getattr(conf, "cache", []) if b.get("branch_scoped") and "ref_prefix" in b]
+    if not backends:
+        print("No branch scoped cache back ends configured", file=sys.stderr)
+        return 0
+
+    fail_count = 0
+    repositories = set()
+    for backend in backends:
+        repository = backend["ref_prefix"]
+        scope = branch_scope(backend, args.branch)
+        if scope is None:
+            print(f"Not deleting the cache of the main branch [{args.branch}] in {repository}", file=sys.stderr)
+            continue
+        if repository in repositories:
+            continue
+        repositories.add(repository)
+        try:
+            tags = list_tags(repository)
+        except FileNotFoundError:
+            print("skopeo is required to delete cache refs, see https://github.com/containers/skopeo", file=sys.stderr)
+            return 1
+        except CalledProcessError as error:
+            print(f"Failed to list the tags of {repository}: {error.stderr.strip()}", file=sys.stderr)
+            fail_count += 1
+            continue
+        for tag in branch_cache_tags(tags, targets, scope):
+            ref = f"{repository}:{tag}"
+            if args.dry:
+                print(ref)
+                continue
+            try:
+                run(["skopeo", "delete", f"docker://{ref}"], capture_output=True, text=True, check=True)
+                print(f"Deleted {ref}", file=sys.stderr)
+            except CalledProcessError as error:
+                print(f"Failed to delete {ref}: {error.stderr.strip()}", file=sys.stderr)
+                fail_count += 1
+
+    return fail_count
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Strategies for splitting Bakefile targets into shards.
+
+Every shard is built by a separate `bake` invocation (usually a separate CI job) and all
+of them compute the assignment independently. Strategies must therefore be deterministic:
+the same targets and Bakefile always produce the same shards.
+"""
+
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set
+
+from .graph import BuildGraph
+from .timings import estimate_durations
+
+SHARD_STRATEGIES = ["modulo", "dependency", "weighted"]
+
+
+def target_parents(bakefile: Dict[str, Any], target: str) -> List[str]:
+    """Names of the Bakefile targets that the given target uses as build contexts."""
+    contexts = bakefile["target"].get(target, {}).get("contexts", {})
+    return [context[len("target:") :] for context in contexts.values() if context.startswith("target:")]
+
+
+def target_ancestors(bakefile: Dict[str, Any], target: str) -> Set[str]:
+    """All targets that must be built before the given target, following the `contexts` chain."""
+    result: Set[str] = set()
+    pending = target_parents(bakefile, target)
+    while pending:
+        parent = pending.pop()
+        if parent not in result:
+            result.add(parent)
+            pending.extend(target_parents(bakefile, parent))
+    return result
+
+
+def modulo_shards(targets: List[str], shard_count: int) -> List[List[str]]:
+    """Round-robin assignment of targets to shards, ignoring dependencies."""
+    return [targets[index::shard_count] for index in range(shard_count)]
+
+
+def dependency_shards(targets: List[str], shard_count: int, graph: BuildGraph) -> List[List[str]]:
+    """
+    Assign targets to shards so that targets sharing ancestors are built by the same shard.
+
+    Targets are visited grouped by their ancestor chain, deepest chains first. Each target is
+    placed on the shard that already builds most of its chain, as long as that shard has not
+    reached its fair share of targets. Within a shard the original target order is kept.
+    """
+    ancestors = {target: graph.ancestors(target) for target in targets}
+    position = {target: index for index, target in enumerate(targets)}
+    capacity = -(-len(targets) // shard_count)
+
+    shards: List[List[str]] = [[] for _ in range(shard_count)]
+    builds: List[Set[str]] = [set() for _ in range(shard_count)]
+
+    for target in sorted(targets, key=lambda t: (-len(ancestors[t]), sorted(ancestors[t]), position[t])):
+        required = ancestors[target] | {target}
+        index = min(
+            (i for i in range(shard_count) if len(shards[i]) < capacity),
+            key=lambda i: (len(required - builds[i]), len(shards[i]), i),
+        )
+        shards[index].append(target)
+        builds[index] |= required
+
+    return [sorted(shard, key=position.__getitem__) for shard in shards]
+
+
+def weighted_shards(
+    targets: List[str], shard_count: int, graph: BuildGraph, timings: Dict[str, float]
+) -> List[List[str]]:
+    """
+    Assign targets to shards using longest-processing-time-first on historical build durations.
+
+    The weight of a target is its own duration plus the durations of the ancestors no other
+    selected target needs. Targets are visited heaviest first and each one is placed on the
+    shard that would finish earliest with it, counting only the ancestors that shard doesn't
+    build yet.
+    """
+    ancestors = {target: graph.ancestors(target) for target in targets}
+    position = {target: index for index, target in enumerate(targets)}
+    durations = estimate_durations(sorted(set(targets).union(*ancestors.values())), timings)
+
+    needed_by = Counter(ancestor for target in targets for ancestor in ancestors[target] | {target})
+    weights = {
+        target: durations[target] + sum(durations[a] for a in ancestors[target] if needed_by[a] == 1)
+        for target in targets
+    }
+
+    shards: List[List[str]] = [[] for _ in range(shard_count)]
+    builds: List[Set[str]] = [set() for _ in range(shard_count)]
+    loads = [0.0] * shard_count
+
+    for target in sorted(targets, key=lambda t: (-weights[t], position[t])):
+        required = ancestors[target] | {target}
+        costs = [sum(durations[t] for t in required - builds[i]) for i in range(shard_count)]
+        index = min(range(shard_count), key=lambda i: (loads[i] + costs[i], i))
+        shards[index].append(target)
+        builds[index] |= required
+        loads[index] += costs[index]
+
+    return [sorted(shard, key=position.__getitem__) for shard in shards]
+
+
+def shard_targets(
+    targets: List[str],
+    shard_count: int,
+    strategy: str = "modulo",
+    graph: Optional[BuildGraph] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> List[List[str]]:
+    """Split targets into `shard_count` shards using the given strategy."""
+    if strategy == "modulo":
+        return modulo_shards(targets, shard_count)
+    if graph is None:
+        raise ValueError(f"Shard strategy [{strategy}] requires the build graph")
+    if strategy == "dependency":
+        return dependency_shards(targets, shard_count, graph)
+    if strategy == "weighted":
+        return weighted_shards(targets, shard_count, graph, timings or {})
+    raise ValueError(f"Unknown shard strategy [{strategy}]. Supported: {SHARD_STRATEGIES}")
+
+
+def duplicated_builds(shards: List[List[str]], graph: BuildGraph) -> List[int]:
+    """
+    For each shard, the number of targets it builds (selected or as an ancestor) that
+    at least one other shard builds as well.
+    """
+    builds = [set(shard).union(*(graph.ancestors(target) for target in shard)) for shard in shards]
+    counts = Counter(target for shard_builds in builds for target in shard_builds)
+    return [sum(1 for target in shard_builds if counts[target] > 1) for shard_builds in builds]
@@ -0,0 +1,71 @@
+"""Persisted state of a bake run, used to resume failed runs.
+
+The state file records every target that was built successfully, together with its image
+digest and a fingerprint of its inputs. When a run is resumed, targets with an unchanged
+fingerprint are not built again. Targets whose fingerprint changed are dropped from the state.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .input_hash import target_input_hashes
+from .lib import write_atomic
+
+
+def target_fingerprints(bakefile: Dict[str, Any], exported: List[str], output: str) -> Dict[str, str]:
+    """
+    Fingerprints of all targets of the Bakefile. They cover the build inputs, the tags and platforms
+    and how the target is exported (e.g. pushed or loaded).
+    """
+    hashes = target_input_hashes(bakefile)
+    result = {}
+    for name, target in bakefile["target"].items():
+        inputs = {
+            "input_hash": hashes[name],
+            "tags": target.get("tags", []),
+            "platforms": target.get("platforms", []),
+            "output": output if name in exported else None,
+        }
+        result[name] = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+    return result
+
+
+class RunState:
+    """
+    Finished targets of a bake run, written to disk whenever a target finished. The state of a previous run is kept
+    until the first target of the new run finished, so that runs that build nothing (e.g. dry runs) don't lose it.
+    """
+
+    def __init__(self, path: str, fingerprints: Dict[str, str], resume: bool = False):
+        self.path = path
+        self.fingerprints = fingerprints
+        self.targets: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                previous = json.load(f).get("targets", {})
+            self.targets = {
+                name: entry
+                for name, entry in previous.items()
+                if fingerprints.get(name) and entry.get("fingerprint") == fingerprints[name]
+            }
+
+    def finished(self) -> Dict[str, Optional[str]]:
+        """Finished targets and their image digests."""
+        return {name: entry.get("digest") for name, entry in self.targets.items()}
+
+    def record(self, target: str, digest: Optional[str]) -> None:
+        with self._lock:
+            self.targets[target] = {
+                "fingerprint": self.fingerprints[target],
+                "digest": digest,
+                "finished": time.time(),
+            }
+            self._save()
+
+    def _save(self) -> None:
+        write_atomic(self.path, json.dumps({"targets": self.targets}, indent=2) + "\n")
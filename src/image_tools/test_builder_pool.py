@@ -0,0 +1,127 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from image_tools.bake import BakeRun, build_target_graph
+from image_tools.builder_pool import BuilderPool, load_builders
+from image_tools.executor import execute_graph
+
+BUILDERS = [
+    {"name": "large", "endpoint": "tcp://localhost:1234", "platforms": ["linux/amd64"], "capacity": 2},
+    {"name": "small", "endpoint": "tcp://localhost:1235", "platforms": ["linux/amd64"]},
+    {"name": "arm64", "platforms": ["linux/arm64"]},
+]
+
+AMD64 = "linux/amd64"
+
+
+class TestBuilderPool(unittest.TestCase):
+    def test_load_builders(self):
+        pool = BuilderPool(load_builders(BUILDERS))
+        self.assertEqual([b.name for b in pool.for_platform(AMD64)], ["large", "small"])
+        self.assertEqual([b.name for b in pool.for_platform("linux/arm64")], ["arm64"])
+        with self.assertRaisesRegex(ValueError, "capacity"):
+            load_builders([{"name": "none", "capacity": 0}])
+
+    def test_least_loaded(self):
+        pool = BuilderPool(load_builders(BUILDERS))
+        placed = [pool.acquire(target, [], AMD64).name for target in ("a", "b", "c")]
+        self.assertEqual(placed, ["large", "small", "large"])
+        self.assertEqual(pool.capacity(AMD64), 3)
+
+    def test_chains_stay_together(self):
+        pool = BuilderPool(load_builders(BUILDERS))
+        base = pool.acquire("base", [], AMD64)
+        pool.release(base)
+        pool.acquire("other", [], AMD64)
+        # The builder of the parent is preferred as long as it has capacity left, even if another one is idle
+        self.assertEqual(pool.acquire("child-1", ["base"], AMD64), base)
+        self.assertNotEqual(pool.acquire("child-2", ["base"], AMD64), base)
+
+    def test_capacity_is_respected(self):
+        pool = BuilderPool(load_builders(BUILDERS))
+        parents = {"base": [], **{f"child-{i}": ["base"] for i in range(6)}}
+        lock = threading.Lock()
+        peak = {builder.name: 0 for builder in pool.for_platform(AMD64)}
+
+        def build(target):
+            builder = pool.acquire(target, parents[target], AMD64)
+            with lock:
+                peak[builder.name] = max(peak[builder.name], pool.load[builder.name])
+            time.sleep(0.05)
+            pool.release(builder)
+            return True
+
+        execute_graph(list(parents), parents, pool.capacity(AMD64), build)
+        self.assertEqual(peak, {"large": 2, "small": 1})
+
+    def test_pool_is_shared_by_platforms(self):
+        # A builder without platforms builds every architecture, but only `capacity` targets at the same time
+        pool = BuilderPool(load_builders([{"name": "any", "capacity": 2}]))
+        lock = threading.Lock()
+        peak = [0]
+
+        def build(platform):
+            def build_target(target):
+                builder = pool.acquire(target, [], platform)
+                with lock:
+                    peak[0] = max(peak[0], pool.load[builder.name])
+                time.sleep(0.05)
+                pool.release(builder)
+                return True
+
+            return build_target
+
+        targets = [f"target-{i}" for i in range(4)]
+        threads = [
+            threading.Thread(
+                target=execute_graph,
+                args=(targets, {t: [] for t in targets}, pool.capacity(platform), build(platform)),
+            )
+            for platform in (AMD64, "linux/arm64")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak, [2])
+        self.assertEqual(pool.load, {"any": 0})
+
+    def test_graph_executor_uses_pool(self):
+        args = mock.Mock(
+            dry=False,
+            push=False,
+            state_file=None,
+            metrics_file=None,
+            metrics_textfile=None,
+            timings_file=None,
+            retries=0,
+            retry_backoff=0,
+            retry_pattern=None,
+            architecture="linux/amd64",
+            builders={},
+        )
+        bakefile = {
+            "target": {
+                "base": {"contexts": {}, "cache-from": ["type=registry,ref=cache:base"]},
+                "child": {"contexts": {"stackable/image/base": "target:base"}},
+            }
+        }
+        with (
+            mock.patch("image_tools.builder_pool.ensure_builder") as ensure_builder,
+            mock.patch("image_tools.bake.run_bake", return_value=BakeRun(0, "", {}, {})) as run_bake,
+        ):
+            pool = BuilderPool(load_builders(BUILDERS))
+            self.assertEqual(build_target_graph(args, ["child"], bakefile, {}, pool), 0)
+            # Every builder is created once, even when several architectures use it
+            pool.ensure(AMD64)
+
+        self.assertEqual(ensure_builder.call_count, 2)
+        commands = [call.args[0].args for call in run_bake.call_args_list]
+        self.assertEqual([cmd[3:5] for cmd in commands], [["--builder", "large"], ["--builder", "large"]])
+        self.assertEqual(pool.load, {"large": 0, "small": 0, "arm64": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Builds with a pool of two BuildKit containers, as described in the README. Needs Docker with buildx and is only run
+with IMAGE_TOOLS_BUILDKIT_TEST=1:
+
+    IMAGE_TOOLS_BUILDKIT_TEST=1 python -m unittest discover -s src -p test_builder_pool_integration.py
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+
+BUILDERS = {"image-tools-test-1": 1234, "image-tools-test-2": 1235}
+
+CONF = """
+products = [
+    {"name": "base", "versions": [{"product": "1"}]},
+    {"name": "app", "versions": [{"product": "1", "base": "1"}, {"product": "2", "base": "1"}]},
+]
+
+builders = [
+    {"name": "image-tools-test-1", "endpoint": "tcp://localhost:1234", "platforms": ["linux/amd64"]},
+    {"name": "image-tools-test-2", "endpoint": "tcp://localhost:1235", "platforms": ["linux/amd64"]},
+]
+"""
+
+
+def docker(*args: str, check: bool = True) -> None:
+    subprocess.run(["docker", *args], check=check, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@unittest.skipUnless(os.environ.get("IMAGE_TOOLS_BUILDKIT_TEST"), "set IMAGE_TOOLS_BUILDKIT_TEST=1 to run")
+class TestBuilderPoolIntegration(unittest.TestCase):
+    def setUp(self):
+        for name, port in BUILDERS.items():
+            self.addCleanup(docker, "rm", "-f", name, check=False)
+            self.addCleanup(docker, "buildx", "rm", name, check=False)
+            docker(
+                *("run", "-d", "--name", name, "--privileged", "-p", f"{port}:{port}"),
+                *("moby/buildkit", "--addr", f"tcp://0.0.0.0:{port}"),
+            )
+        for name, port in BUILDERS.items():
+            for _ in range(30):
+                ready = subprocess.run(
+                    ["docker", "exec", name, "buildctl", "--addr", f"tcp://localhost:{port}", "debug", "workers"],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                if ready.returncode == 0:
+                    break
+                time.sleep(1)
+
+    def write(self, path: str, content: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            f.write(textwrap.dedent(content))
+
+    def test_build_with_pool(self):
+        src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with tempfile.TemporaryDirectory() as tmp:
+            self.write(os.path.join(tmp, "conf.py"), CONF)
+            self.write(os.path.join(tmp, "base", "Dockerfile"), "FROM scratch\nCOPY base/Dockerfile /base\n")
+            self.write(os.path.join(tmp, "app", "Dockerfile"), "FROM stackable/image/base\nCOPY app/Dockerfile /app\n")
+            # The revision label is read from git
+            git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+            subprocess.run([*git, "init", "-q"], cwd=tmp, check=True)
+            subprocess.run([*git, "commit", "-q", "--allow-empty", "-m", "test"], cwd=tmp, check=True)
+
+            bake = ["-c", "conf.py", "--executor", "graph", "--export-tags-file", "tags"]
+            result = subprocess.run(
+                [sys.executable, "-m", "image_tools.cli", *bake],
+                cwd=tmp,
+                env={**os.environ, "PYTHONPATH": src},
+                capture_output=True,
+                text=True,
+            )
+            if os.path.exists(os.path.join(tmp, "tags")):
+                with open(os.path.join(tmp, "tags")) as f:
+                    for tag in f.read().split():
+                        self.addCleanup(docker, "rmi", tag, check=False)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # The second version of app is placed on the other builder while the first one is building
+        used = {name for name in BUILDERS if f"on builder [{name}]" in result.stderr}
+        self.assertEqual(used, set(BUILDERS), result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
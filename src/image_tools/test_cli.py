@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from image_tools.cli import fast_path, list_products_options
+
+
+class TestCli(unittest.TestCase):
+    def test_list_products_options(self):
+        self.assertEqual(
+            list_products_options(["--configuration=other.py", "--list-products", "--no-configuration-cache"]),
+            {"configuration": "other.py", "cache": False},
+        )
+        self.assertEqual(
+            list_products_options(["--list-products", "--configuration-cache-dir", "/tmp/cache"]),
+            {"configuration": "./conf.py", "cache": True, "cache_dir": "/tmp/cache"},
+        )
+        self.assertIsNone(list_products_options(["--list-products", "--build-arg", "a=b"]))
+
+    def test_full_bake_arguments(self):
+        self.assertIsNone(fast_path(["--version", "--dry"]))
+        self.assertIsNone(fast_path(["-p", "opa", "--dry"]))
+        self.assertIsNone(fast_path(["--completions", "bash"]))
+        self.assertIsNone(fast_path(["--completions=zsh"]))
+
+    def test_list_products_imports(self):
+        # Modules that are only needed to build images or to run preflight checks
+        modules = ("image_tools.shard", "image_tools.preflight_cache", "subprocess")
+        code = f"import sys, image_tools.args; print([m for m in {modules} if m in sys.modules])"
+        src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "PYTHONPATH": src},
+        )
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
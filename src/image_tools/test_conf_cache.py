@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from image_tools.args import load_configuration
+from image_tools.conf_cache import ConfigurationCache
+
+CONF = """
+from versions import opa_versions
+
+products = [{"name": "opa", "versions": opa_versions}]
+args = {"DELETE_CACHES": "true"}
+"""
+
+
+class TestConfigurationCache(unittest.TestCase):
+    def test_cache_until_imported_module_changes(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with open("conf.py", "w") as f:
+                    f.write(CONF)
+                with open("versions.py", "w") as f:
+                    f.write('opa_versions = [{"product": "0.51.0", "Vector": "0.31.0"}]\n')
+                cache_dir = os.path.join(tmp, "cache")
+
+                conf = load_configuration("conf.py", [("VECTOR", "0.33.0")], cache_dir)
+                self.assertEqual(
+                    conf.products[0]["versions"], [{"delete_caches": "true", "product": "0.51.0", "vector": "0.33.0"}]
+                )
+                self.assertEqual(
+                    ConfigurationCache(cache_dir).get("conf.py").products[0]["versions"],
+                    [{"delete_caches": "true", "product": "0.51.0", "vector": "0.31.0"}],
+                )
+
+                with open("versions.py", "a") as f:
+                    f.write('opa_versions.append({"product": "0.61.0", "vector": "0.31.0"})\n')
+                self.assertIsNone(ConfigurationCache(cache_dir).get("conf.py"))
+                sys.modules.pop("versions")
+                conf = load_configuration("conf.py", [], cache_dir)
+                self.assertEqual([v["product"] for v in conf.products[0]["versions"]], ["0.51.0", "0.61.0"])
+            finally:
+                sys.modules.pop("versions", None)
+                os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import threading
+import time
+import unittest
+
+from image_tools.executor import (
+    FAILED,
+    SKIPPED,
+    SUCCEEDED,
+    RetryPolicy,
+    critical_path,
+    execute_graph,
+    predict_makespan,
+    retry,
+    topological_waves,
+)
+
+PARENTS = {
+    "java-base": ["vector"],
+    "hadoop": ["java-base"],
+    "hbase": ["hadoop", "java-base"],
+    "opa": ["vector"],
+    "vector": [],
+}
+TARGETS = ["vector", "java-base", "hadoop", "hbase", "opa"]
+DURATIONS = {"vector": 1.0, "java-base": 2.0, "hadoop": 10.0, "hbase": 5.0, "opa": 3.0}
+
+
+class TestExecutor(unittest.TestCase):
+    def test_topological_waves(self):
+        self.assertEqual(
+            topological_waves(TARGETS, PARENTS),
+            [["vector"], ["java-base", "opa"], ["hadoop"], ["hbase"]],
+        )
+        with self.assertRaises(ValueError):
+            topological_waves(["a", "b"], {"a": ["b"], "b": ["a"]})
+
+    def test_failure_only_stops_descendants(self):
+        built = []
+
+        def build(target):
+            built.append(target)
+            return target != "java-base"
+
+        status = execute_graph(TARGETS, PARENTS, 2, build)
+        self.assertEqual(
+            status,
+            {"vector": SUCCEEDED, "java-base": FAILED, "hadoop": SKIPPED, "hbase": SKIPPED, "opa": SUCCEEDED},
+        )
+        self.assertEqual(sorted(built), ["java-base", "opa", "vector"])
+
+    def test_parents_finish_first_and_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        running = []
+        max_running = 0
+        finished = set()
+
+        def build(target):
+            nonlocal max_running
+            self.assertTrue(all(parent in finished for parent in PARENTS[target]))
+            with lock:
+                running.append(target)
+                max_running = max(max_running, len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(target)
+                finished.add(target)
+            return True
+
+        status = execute_graph(TARGETS, PARENTS, 2, build)
+        self.assertTrue(all(s == SUCCEEDED for s in status.values()))
+        self.assertEqual(max_running, 2)
+
+    def test_critical_path(self):
+        self.assertEqual(critical_path(TARGETS, PARENTS, DURATIONS), ["vector", "java-base", "hadoop", "hbase"])
+        self.assertEqual(predict_makespan(TARGETS, PARENTS, DURATIONS, 1), 21.0)
+        self.assertEqual(predict_makespan(TARGETS, PARENTS, DURATIONS, 2), 18.0)
+
+    def test_critical_path_starts_first(self):
+        started = []
+        durations = {**DURATIONS, "opa": 100.0}
+        execute_graph(TARGETS, PARENTS, 1, lambda target: started.append(target) or True, durations)
+        self.assertEqual(started, ["vector", "opa", "java-base", "hadoop", "hbase"])
+
+    def test_retry_transient_errors(self):
+        policy = RetryPolicy(retries=2, backoff=0)
+        outputs = ["ERROR: failed to push: unexpected EOF", ""]
+        retried: list = []
+        self.assertTrue(retry(policy, "opa", lambda: (not outputs[0], outputs.pop(0)), retried))
+        self.assertEqual(retried, ["opa (unexpected EOF)"])
+
+        attempts = []
+        self.assertFalse(retry(policy, "opa", lambda: attempts.append(1) or (False, "syntax error"), retried))
+        self.assertEqual(len(attempts), 1)
+
+        attempts.clear()
+        self.assertFalse(retry(policy, "opa", lambda: attempts.append(1) or (False, "i/o timeout"), retried))
+        self.assertEqual(len(attempts), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,26 @@
 from image_tools.test import conf
+import io
+import json
+import os
+import subprocess
+import tempfile
 import unittest
 import sys
+from unittest import mock
 
 from image_tools.args import bake_args
-from image_tools.bake import generate_bakefile
+from image_tools.bake import (
+    architecture_args,
+    build_architectures,
+    generate_bakefile,
+    generate_cache_from,
+    generate_cache_location,
+    get_build_timestamp,
+    get_git_directory_revisions,
+    get_git_revision,
+    prune_bakefile,
+)
+from image_tools.graph import BuildGraph
 
 
 class TestGenerateBakefile(unittest.TestCase):
@@ -12,3 +29,149 @@ class TestGenerateBakefile(unittest.TestCase):
         bargs = bake_args()
         bakefile = generate_bakefile(bargs, conf)
         self.assertIsNotNone(bakefile)
+
+    def test_prune_bakefile(self):
+        sys.argv = ["test", "-p", "opa=0.37.2"]
+        bargs = bake_args()
+        bakefile = prune_bakefile(generate_bakefile(bargs, conf), ["opa-0_37_2"])
+        self.assertEqual(list(bakefile["target"].keys()), ["vector-0_31_0", "opa-0_37_2", "stackable-base-1_0_0"])
+        self.assertEqual(bakefile["group"]["opa"], {"targets": ["opa-0_37_2"]})
+        self.assertEqual(bakefile["group"]["default"], {"targets": ["vector", "opa", "stackable-base"]})
+
+    def test_single_build_timestamp(self):
+        sys.argv = ["test"]
+        bakefile = generate_bakefile(bake_args(), conf)
+        created = {target["labels"]["org.opencontainers.image.created"] for target in bakefile["target"].values()}
+        self.assertEqual(len(created), 1)
+
+    def test_reproducible_build_timestamp(self):
+        sys.argv = ["test", "--reproducible"]
+        get_build_timestamp.cache_clear()
+        with mock.patch.dict(os.environ, {"SOURCE_DATE_EPOCH": "1700000000"}):
+            bakefile = generate_bakefile(bake_args(), conf)
+        get_build_timestamp.cache_clear()
+        target = bakefile["target"]["opa-0_51_0"]
+        self.assertEqual(target["labels"]["build-date"], "2023-11-14T22:13:20+00:00")
+        self.assertEqual(target["args"]["SOURCE_DATE_EPOCH"], "1700000000")
+
+    def test_cache_from_fallbacks(self):
+        cache = [
+            {
+                "type": "registry",
+                "ref_prefix": "registry/cache",
+                "mode": "max",
+                "cache_from": [
+                    "{ref_prefix}:{target}-{arch}",
+                    "registry/cache:{target}-{arch}-{branch}",
+                    "{ref_prefix}:{previous_target}-{arch}",
+                ],
+            }
+        ]
+        self.assertEqual(
+            generate_cache_from(cache, "opa-0_51_0", "linux/amd64", "opa-0_37_2", "feat/opa"),
+            [
+                "type=registry,mode=max,ref=registry/cache:opa-0_51_0-linux_amd64",
+                "type=registry,mode=max,ref=registry/cache:opa-0_51_0-linux_amd64-feat-opa",
+                "type=registry,mode=max,ref=registry/cache:opa-0_37_2-linux_amd64",
+            ],
+        )
+        self.assertEqual(
+            generate_cache_from(cache, "opa-0_37_2", "linux/amd64"),
+            ["type=registry,mode=max,ref=registry/cache:opa-0_37_2-linux_amd64"],
+        )
+
+        sys.argv = ["test", "--cache", "--cache-branch", "main"]
+        with mock.patch.object(conf, "cache", cache):
+            target = generate_bakefile(bake_args(), conf)["target"]["opa-0_51_0"]
+        self.assertEqual(target["cache-to"], ["type=registry,mode=max,ref=registry/cache:opa-0_51_0-linux_amd64"])
+        self.assertEqual(len(target["cache-from"]), 3)
+
+    def test_branch_scoped_cache(self):
+        cache = [{"type": "registry", "ref_prefix": "registry/cache", "branch_scoped": True}]
+        self.assertEqual(
+            generate_cache_location(cache, "opa-0_51_0", "linux/amd64", "feat/opa"),
+            ["type=registry,ref=registry/cache:opa-0_51_0-linux_amd64-feat-opa"],
+        )
+        self.assertEqual(
+            generate_cache_from(cache, "opa-0_51_0", "linux/amd64", None, "feat/opa"),
+            [
+                "type=registry,ref=registry/cache:opa-0_51_0-linux_amd64-feat-opa",
+                "type=registry,ref=registry/cache:opa-0_51_0-linux_amd64",
+            ],
+        )
+        for location in (generate_cache_location, generate_cache_from):
+            self.assertEqual(
+                location(cache, "opa-0_51_0", "linux/amd64", branch="main"),
+                ["type=registry,ref=registry/cache:opa-0_51_0-linux_amd64"],
+            )
+        # A detached HEAD must not write to the cache of the main branch
+        with mock.patch("sys.stderr", io.StringIO()):
+            self.assertEqual(generate_cache_location(cache, "opa-0_51_0", "linux/amd64", None), [])
+        self.assertEqual(
+            generate_cache_from(cache, "opa-0_51_0", "linux/amd64", None, None),
+            ["type=registry,ref=registry/cache:opa-0_51_0-linux_amd64"],
+        )
+
+    def test_multi_architecture_build(self):
+        sys.argv = ["test", "-a", "linux/amd64", "-a", "linux/arm64", "--builder", "linux/arm64=arm64", "--push"]
+        args = bake_args()
+        # Looked up before `run` is replaced
+        get_git_revision()
+        with mock.patch("image_tools.bake.run") as run:
+            run.return_value.returncode = 0
+            self.assertEqual(build_architectures(args, conf, BuildGraph.from_conf(conf), ["opa-0_51_0"]), 0)
+
+        calls = [call.args[0] for call in run.call_args_list]
+        bake_calls = {" ".join(cmd[:5]): cmd for cmd in calls if cmd[2] == "bake"}
+        self.assertEqual(set(bake_calls), {"docker buildx bake --file -", "docker buildx bake --builder arm64"})
+        arm64 = json.loads(
+            next(call.kwargs["input"] for call in run.call_args_list if "--builder" in call.args[0]).decode("utf-8")
+        )
+        self.assertEqual(arm64["target"]["opa-0_51_0"]["platforms"], ["linux/arm64"])
+        self.assertEqual(
+            arm64["target"]["opa-0_51_0"]["tags"], ["oci.stackable.tech/sdp/opa:0.51.0-stackable0.0.0-dev-arm64"]
+        )
+
+        tag = "oci.stackable.tech/sdp/opa:0.51.0-stackable0.0.0-dev"
+        self.assertEqual(
+            calls[-1], ["docker", "buildx", "imagetools", "create", "--tag", tag, f"{tag}-amd64", f"{tag}-arm64"]
+        )
+
+    def test_emulated_architectures(self):
+        sys.argv = ["test", "-a", "linux/amd64", "-a", "linux/arm64", "--timings-file", "timings.json", "--dry"]
+        args = bake_args()
+        # Each architecture updates its own durations
+        self.assertEqual(architecture_args(args, "linux/arm64").timings_file, "timings.json")
+
+        get_git_revision()
+        stderr = io.StringIO()
+        with (
+            mock.patch("platform.machine", return_value="x86_64"),
+            mock.patch("image_tools.bake.run") as run,
+            mock.patch("sys.stderr", stderr),
+        ):
+            run.return_value.returncode = 0
+            build_architectures(args, conf, BuildGraph.from_conf(conf), ["opa-0_51_0"])
+        self.assertIn("No builder given for [linux/arm64]", stderr.getvalue())
+        self.assertNotIn("[linux/amd64]", stderr.getvalue())
+
+    def test_git_directory_revisions(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+                subprocess.run(["git", "init", "-q"], check=True)
+                for directory in ("java-base", "opa", "java-base"):
+                    os.makedirs(directory, exist_ok=True)
+                    with open(os.path.join(directory, "Dockerfile"), "a") as f:
+                        f.write("FROM scratch\n")
+                    subprocess.run(["git", "add", "."], check=True)
+                    subprocess.run([*git, "commit", "-q", "-m", directory], check=True)
+                head = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+                revisions = get_git_directory_revisions(("java-base", "opa", "vector"))
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(revisions["java-base"][:2], (1, head))
+        self.assertEqual(revisions["opa"][0], 2)
+        self.assertNotIn("vector", revisions)
@@ -0,0 +1,71 @@
+from image_tools.test import conf
+import sys
+import unittest
+from unittest import mock
+
+from image_tools.bake import targets_changed_since
+from image_tools.graph import BuildGraph, TargetNode
+
+
+class TestBuildGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = BuildGraph.from_conf(conf)
+
+    def test_select(self):
+        self.assertEqual(self.graph.select(["opa=0.37.2", "java-base"]), ["opa-0_37_2", "java-base-11", "java-base-17"])
+        self.assertEqual(len(self.graph.select([])), len(self.graph.targets))
+        with self.assertRaisesRegex(ValueError, "unknown product"):
+            self.graph.select(["unknown"])
+        with self.assertRaisesRegex(ValueError, "unknown version"):
+            self.graph.select(["opa=0.0.1"])
+
+    def test_adjacency(self):
+        node = self.graph.targets["druid-26_0_0"]
+        self.assertEqual((node.product, node.version), ("druid", "26.0.0"))
+        self.assertEqual(node.parents, ["java-base-11"])
+        self.assertIn("druid-26_0_0", self.graph.children("java-base-11"))
+        self.assertEqual(
+            self.graph.ancestors("druid-26_0_0"), {"java-base-11", "vector-0_31_0", "stackable-base-1_0_0"}
+        )
+
+    def test_ancestors_of_long_chain(self):
+        depth = 3 * sys.getrecursionlimit()
+        graph = BuildGraph(TargetNode(f"t{i}", f"t{i}", "1", [f"t{i - 1}"] if i else []) for i in range(depth))
+        self.assertEqual(len(graph.ancestors(f"t{depth - 1}")), depth - 1)
+
+    def test_ancestors_of_cycle(self):
+        graph = BuildGraph(
+            [TargetNode("a", "a", "1", ["b"]), TargetNode("b", "b", "1", ["c"]), TargetNode("c", "c", "1", ["b"])]
+        )
+        with self.assertRaisesRegex(ValueError, "Dependency cycle: b -> c -> b"):
+            graph.ancestors("a")
+
+    def test_with_dependents(self):
+        targets = self.graph.with_dependents(["java-base-11"])
+        self.assertEqual(targets[0], "java-base-11")
+        self.assertIn("druid-26_0_0", targets)
+        self.assertNotIn("java-base-17", targets)
+        self.assertEqual(len(targets), len(set(targets)))
+
+    def test_changed_since(self):
+        changed = ["opa/Dockerfile", "opa/stackable/patches/0.51.0/01.patch"]
+        with mock.patch("image_tools.bake.get_git_changed_files", return_value=changed):
+            targets = targets_changed_since(self.graph, "main", {})
+        self.assertEqual(targets, [node.name for node in self.graph.products["opa"]])
+        self.assertIsNone(self.graph.product_for_path("opa"))
+
+    def test_changed_since_copied_source(self):
+        sources = {"java-base-11": ["java-base", "shared/log4j.properties"], "opa-0_51_0": ["opa"]}
+        with mock.patch("image_tools.bake.get_git_changed_files", return_value=["shared/log4j.properties"]):
+            targets = targets_changed_since(self.graph, "main", sources)
+        self.assertEqual(targets, self.graph.with_dependents(["java-base-11"]))
+
+    def test_changed_since_unknown_path(self):
+        # Version pins in conf.py belong to no product directory
+        with mock.patch("image_tools.bake.get_git_changed_files", return_value=["opa/Dockerfile", "conf.py"]):
+            targets = targets_changed_since(self.graph, "main", {"opa-0_51_0": ["opa"]})
+        self.assertEqual(targets, list(self.graph.targets))
+
+
+if __name__ == "__main__":
+    unittest.main()
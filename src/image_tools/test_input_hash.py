@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+
+from image_tools.input_hash import dockerfile_sources, is_source, target_input_hashes, target_sources
+
+
+DOCKERFILE = """
+FROM stackable/image/java-base AS builder
+ARG PRODUCT
+# COPY ignored/by/comment /
+COPY --chown=1000:0 opa/stackable/patches/${PRODUCT} /stackable/patches
+COPY --from=builder /stackable /stackable
+ADD https://example.com/archive.tar.gz /tmp/
+COPY ["shared/a.txt", "shared/b.txt", "/stackable/"]
+RUN echo \\
+    COPY not/an/instruction /
+"""
+
+
+class TestInputHash(unittest.TestCase):
+    def test_dockerfile_sources(self):
+        self.assertEqual(
+            dockerfile_sources(DOCKERFILE, {"PRODUCT": "0.51.0"}),
+            ["opa/stackable/patches/0.51.0", "shared/a.txt", "shared/b.txt"],
+        )
+
+    def test_input_hash_changes_with_parent(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for product in ("base", "app"):
+                os.makedirs(os.path.join(tmp, product))
+                with open(os.path.join(tmp, product, "Dockerfile"), "w") as f:
+                    f.write(f"FROM scratch\nCOPY {product}/file /file\n")
+                with open(os.path.join(tmp, product, "file"), "w") as f:
+                    f.write("v1")
+            bakefile = {
+                "target": {
+                    "base-1": {"context": tmp, "dockerfile": "base/Dockerfile", "args": {}},
+                    "app-1": {
+                        "context": tmp,
+                        "dockerfile": "app/Dockerfile",
+                        "args": {"PRODUCT": "1"},
+                        "contexts": {"stackable/image/base": "target:base-1"},
+                    },
+                }
+            }
+            before = target_input_hashes(bakefile)
+            self.assertEqual(before, target_input_hashes(bakefile))
+
+            with open(os.path.join(tmp, "base", "file"), "w") as f:
+                f.write("v2")
+            after = target_input_hashes(bakefile)
+            self.assertNotEqual(before["base-1"], after["base-1"])
+            self.assertNotEqual(before["app-1"], after["app-1"])
+
+    def test_input_hash_changes_with_shared_source(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "app", "stackable"))
+            os.makedirs(os.path.join(tmp, "shared"))
+            with open(os.path.join(tmp, "app", "Dockerfile"), "w") as f:
+                f.write("FROM scratch\nCOPY shared/file /file\n")
+            with open(os.path.join(tmp, "app", "stackable", "file"), "w") as f:
+                f.write("app")
+            with open(os.path.join(tmp, "shared", "file"), "w") as f:
+                f.write("v1")
+            bakefile = {"target": {"app-1": {"context": tmp, "dockerfile": "app/Dockerfile", "args": {}}}}
+            before = target_input_hashes(bakefile)
+
+            # Outside of the product directory, which is walked first
+            with open(os.path.join(tmp, "shared", "file"), "w") as f:
+                f.write("v2")
+            self.assertNotEqual(before, target_input_hashes(bakefile))
+
+    def test_input_hash_of_cycle(self):
+        bakefile = {
+            "target": {
+                "a-1": {"dockerfile": "a/Dockerfile", "contexts": {"stackable/image/b": "target:b-1"}},
+                "b-1": {"dockerfile": "b/Dockerfile", "contexts": {"stackable/image/a": "target:a-1"}},
+            }
+        }
+        with self.assertRaisesRegex(ValueError, "Dependency cycle: a-1 -> b-1 -> a-1"):
+            target_input_hashes(bakefile)
+
+    def test_target_sources(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "opa"))
+            with open(os.path.join(tmp, "opa", "Dockerfile"), "w") as f:
+                f.write(DOCKERFILE)
+            bakefile = {
+                "target": {
+                    "opa-0_51_0": {"context": tmp, "dockerfile": "opa/Dockerfile", "args": {"PRODUCT": "0.51.0"}}
+                }
+            }
+            sources = target_sources(bakefile)["opa-0_51_0"]
+
+        self.assertEqual(sources, ["opa", "opa/stackable/patches/0.51.0", "shared/a.txt", "shared/b.txt"])
+        self.assertTrue(is_source("shared/a.txt", sources))
+        self.assertTrue(is_source("opa/stackable/patches/0.51.0/01.patch", sources))
+        self.assertFalse(is_source("shared/c.txt", sources))
+        self.assertTrue(is_source("shared/c.txt", ["shared/*.txt"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from image_tools.lib import write_atomic
+
+
+class TestLib(unittest.TestCase):
+    def test_concurrent_writers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "state.json")
+            errors = []
+
+            def write(writer):
+                try:
+                    for i in range(50):
+                        write_atomic(path, f"{writer}-{i}\n" * 1000)
+                except OSError as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=write, args=(writer,)) for writer in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(os.listdir(tmp), ["state.json"])
+            with open(path) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(set(lines)), 1)
+
+            umask = os.umask(0)
+            os.umask(umask)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~umask)
+
+
+if __name__ == "__main__":
+    unittest.main()
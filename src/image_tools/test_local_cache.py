@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+import unittest
+
+from image_tools.bake import generate_cache_from, generate_cache_location
+from image_tools.local_cache import cache_destination, cache_source, commit_local_caches
+
+
+def export_cache(directory: str, target: str, size: int) -> None:
+    destination = cache_destination(directory, target, "linux/amd64")
+    os.makedirs(os.path.join(destination, "blobs"))
+    with open(os.path.join(destination, "blobs", "layer"), "wb") as f:
+        f.write(b"0" * size)
+    with open(os.path.join(destination, "index.json"), "w") as f:
+        f.write("{}")
+
+
+class TestLocalCache(unittest.TestCase):
+    def test_commit_and_evict(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = [{"type": "local", "directory": tmp, "max_size": "250B", "mode": "max"}]
+            self.assertEqual(
+                generate_cache_location(cache, "opa-0_51_0", "linux/amd64"),
+                [f"type=local,mode=max,dest={cache_destination(tmp, 'opa-0_51_0', 'linux/amd64')}"],
+            )
+            self.assertEqual(generate_cache_from(cache, "opa-0_51_0", "linux/amd64"), [])
+
+            for target in ("vector-0_31_0", "opa-0_51_0"):
+                export_cache(tmp, target, 100)
+                self.assertEqual(commit_local_caches(cache, [target], "linux/amd64"), [])
+                time.sleep(0.01)
+            first = os.path.realpath(cache_source(tmp, "opa-0_51_0", "linux/amd64"))
+
+            # A new export replaces the previous one and the least recently used cache is evicted
+            export_cache(tmp, "opa-0_51_0", 200)
+            self.assertEqual(
+                commit_local_caches(cache, ["vector-0_31_0", "opa-0_51_0"], "linux/amd64"),
+                ["vector-0_31_0-linux_amd64"],
+            )
+            self.assertFalse(os.path.exists(first))
+            self.assertEqual(
+                generate_cache_from(cache, "opa-0_51_0", "linux/amd64"),
+                [f"type=local,mode=max,src={cache_source(tmp, 'opa-0_51_0', 'linux/amd64')}"],
+            )
+            self.assertEqual(len(os.listdir(tmp)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
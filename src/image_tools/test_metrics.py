@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+
+from image_tools.metrics import BuildMetrics, write_prometheus_textfile
+
+STREAM = [
+    {
+        "vertexes": [
+            {"digest": "sha256:a", "name": "[opa-0_51_0 1/3] FROM stackable/image/vector", "cached": True},
+            {"digest": "sha256:b", "name": "[opa-0_51_0 2/3] RUN make", "started": "2024-01-01T00:00:00.5Z"},
+            {"digest": "sha256:c", "name": "[internal] load .dockerignore", "started": "2024-01-01T00:00:00Z"},
+        ]
+    },
+    {
+        "vertexes": [
+            {
+                "digest": "sha256:a",
+                "name": "[opa-0_51_0 1/3] FROM stackable/image/vector",
+                "cached": True,
+                "started": "2024-01-01T00:00:00.000000001Z",
+                "completed": "2024-01-01T00:00:00.25Z",
+            },
+            {
+                "digest": "sha256:b",
+                "name": "[opa-0_51_0 2/3] RUN make",
+                "started": "2024-01-01T00:00:00.5Z",
+                "completed": "2024-01-01T00:01:00.5Z",
+            },
+        ]
+    },
+    {
+        "vertexes": [{"digest": "sha256:d", "name": "[opa-0_51_0 3/3] exporting to image"}],
+        "statuses": [
+            {"id": "pushing layer sha256:1", "vertex": "sha256:d", "total": 100, "current": 50},
+            {"id": "pushing layer sha256:1", "vertex": "sha256:d", "total": 100, "current": 100},
+            {"id": "pushing layer sha256:2", "vertex": "sha256:d", "total": 20, "current": 20},
+        ],
+    },
+]
+
+
+class TestMetrics(unittest.TestCase):
+    def test_report(self):
+        metrics = BuildMetrics(["opa-0_51_0"])
+        completed = [v.name for line in STREAM for v in metrics.feed(json.dumps(line))]
+        self.assertEqual(completed, ["[opa-0_51_0 1/3] FROM stackable/image/vector", "[opa-0_51_0 2/3] RUN make"])
+        self.assertEqual(metrics.feed("not json"), [])
+
+        report = metrics.report()
+        self.assertEqual(list(report.keys()), ["opa-0_51_0"])
+        opa = report["opa-0_51_0"]
+        self.assertAlmostEqual(opa["duration_seconds"], 60.5)
+        # The unprefixed internal step belongs to the only target of the call
+        self.assertEqual((opa["cached_steps"], opa["executed_steps"]), (1, 3))
+        self.assertEqual(opa["slowest_steps"][0], {"name": "[opa-0_51_0 2/3] RUN make", "duration_seconds": 60.0})
+        self.assertEqual(opa["pushed_bytes"], 120)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bake.prom")
+            write_prometheus_textfile(path, report)
+            with open(path) as f:
+                self.assertIn('bake_target_pushed_bytes{target="opa-0_51_0"} 120\n', f.read())
+
+    def test_single_target_without_prefixes(self):
+        metrics = BuildMetrics(["stackable-base-1_0_0"], ["stackable-base-1_0_0", "vector-0_31_0"])
+        stream = {
+            "vertexes": [
+                {"digest": "sha256:a", "name": "[internal] load build definition from Dockerfile", "cached": True},
+                {
+                    "digest": "sha256:b",
+                    "name": "[builder 2/3] RUN microdnf install",
+                    "started": "2024-01-01T00:00:00Z",
+                    "completed": "2024-01-01T00:00:10Z",
+                },
+                # A parent that is built as build context of the target
+                {
+                    "digest": "sha256:c",
+                    "name": "[vector-0_31_0 1/2] FROM registry.access.redhat.com/ubi9",
+                    "cached": True,
+                },
+            ]
+        }
+        metrics.feed(json.dumps(stream))
+
+        report = metrics.report()["stackable-base-1_0_0"]
+        self.assertEqual((report["cached_steps"], report["executed_steps"]), (1, 1))
+        self.assertEqual(report["duration_seconds"], 10.0)
+
+        # With several targets, vertices without a target prefix belong to none of them
+        metrics = BuildMetrics(["stackable-base-1_0_0", "vector-0_31_0"])
+        metrics.feed(json.dumps(stream))
+        self.assertEqual(list(metrics.report()), ["vector-0_31_0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+from image_tools.test import conf
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from image_tools.args import bake_args
+from image_tools.bake import create_plan, execute_plan, generate_bakefile, load_plan
+from image_tools.graph import BuildGraph
+from image_tools.input_hash import INPUT_HASH_LABEL
+from image_tools.local_cache import cache_source
+
+
+def fake_input_hashes(bakefile):
+    return {target: f"hash-{target}" for target in bakefile["target"]}
+
+
+def context_input_hashes(bakefile):
+    # Like the real input hashes, these change when the contexts of a target are rewritten
+    return {
+        name: f"hash-{name}-{json.dumps(target['contexts'], sort_keys=True)}"
+        for name, target in bakefile["target"].items()
+    }
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.graph = BuildGraph.from_conf(conf)
+
+    def plan(self, *argv):
+        sys.argv = ["test", "plan", "--output", "plan.json", *argv]
+        args = bake_args()
+        with mock.patch("image_tools.bake.target_input_hashes", side_effect=fake_input_hashes):
+            return create_plan(args, conf, self.graph, generate_bakefile(args, conf, self.graph), {})
+
+    def test_create_plan(self):
+        plan = self.plan("-p", "opa", "--shard-count", "2", "--shard-strategy", "dependency")
+        opa = [node.name for node in self.graph.products["opa"]]
+        self.assertEqual(sorted(sum(plan["shards"], [])), sorted(opa))
+        self.assertEqual(list(plan["tags"]), sum(plan["shards"], []))
+        self.assertEqual(set(plan["input_hashes"]), set(plan["bakefile"]["target"]))
+        self.assertIn("stackable-base-1_0_0", plan["bakefile"]["target"])
+        self.assertEqual(plan["matrix"]["include"], [{"shard": i} for i, shard in enumerate(plan["shards"]) if shard])
+        self.assertEqual(plan["options"]["architecture"], "linux/amd64")
+
+    def test_plan_input_hashes_match_labels(self):
+        sys.argv = ["test", "plan", "--output", "plan.json", "-p", "opa=0.51.0", "--skip-unchanged"]
+        args = bake_args()
+        bakefile = generate_bakefile(args, conf, self.graph)
+        published = {
+            target["tags"][0]: hash
+            for name, hash in context_input_hashes(bakefile).items()
+            if name != "opa-0_51_0"
+            for target in [bakefile["target"][name]]
+        }
+        with (
+            mock.patch("image_tools.bake.target_input_hashes", side_effect=context_input_hashes),
+            mock.patch(
+                "image_tools.input_hash.published_input_hash", side_effect=lambda image, _: published.get(image)
+            ),
+        ):
+            plan = create_plan(args, conf, self.graph, bakefile, {})
+
+        self.assertEqual(plan["shards"], [["opa-0_51_0"]])
+        target = plan["bakefile"]["target"]["opa-0_51_0"]
+        # The parents are used from the registry, but the hash is the one of the image label
+        self.assertTrue(all(value.startswith("docker-image://") for value in target["contexts"].values()))
+        self.assertEqual(plan["input_hashes"], {"opa-0_51_0": target["labels"][INPUT_HASH_LABEL]})
+
+    def test_execute_plan(self):
+        plan = self.plan("-p", "opa", "--shard-count", "2")
+        with tempfile.TemporaryDirectory() as tmp:
+            plan_file = os.path.join(tmp, "plan.json")
+            with open(plan_file, "w") as f:
+                json.dump(plan, f)
+            sys.argv = ["test", "execute", "--plan", plan_file, "--shard", "1"]
+            args = bake_args()
+            with mock.patch("image_tools.bake.run") as run:
+                run.return_value.returncode = 0
+                self.assertEqual(execute_plan(args, load_plan(plan_file)), 0)
+
+        cmd = run.call_args.args[0]
+        self.assertEqual(cmd[5 : 5 + len(plan["shards"][1])], plan["shards"][1])
+        bakefile = json.loads(run.call_args.kwargs["input"].decode("utf-8"))
+        self.assertTrue(set(plan["shards"][1]) <= set(bakefile["target"]))
+        self.assertNotIn(plan["shards"][0][0], bakefile["target"])
+
+        args.shard = 2
+        with self.assertRaisesRegex(ValueError, "no shard"):
+            execute_plan(args, plan)
+
+    def test_execute_plan_with_local_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = [{"type": "local", "directory": os.path.join(tmp, "cache"), "mode": "max"}]
+            with mock.patch.object(conf, "cache", cache, create=True):
+                plan = self.plan("-p", "opa=0.51.0", "--cache")
+            target = plan["bakefile"]["target"]["opa-0_51_0"]
+            # The export directory belongs to the process that builds the target
+            self.assertEqual((target["cache-to"], target["cache-from"]), ([], []))
+
+            plan_file = os.path.join(tmp, "plan.json")
+            with open(plan_file, "w") as f:
+                json.dump(plan, f)
+            sys.argv = ["test", "execute", "--plan", plan_file, "--shard", "0"]
+
+            def export_caches(cmd, **kwargs):
+                # What BuildKit does with `type=local` caches
+                for target in json.loads(kwargs["input"].decode("utf-8"))["target"].values():
+                    for entry in target["cache-to"]:
+                        dest = dict(option.split("=", 1) for option in entry.split(","))["dest"]
+                        os.makedirs(dest)
+                        open(os.path.join(dest, "index.json"), "w").close()
+                return mock.Mock(returncode=0)
+
+            with mock.patch("image_tools.bake.run", side_effect=export_caches):
+                self.assertEqual(execute_plan(bake_args(), load_plan(plan_file)), 0)
+
+            source = cache_source(cache[0]["directory"], "opa-0_51_0", "linux/amd64")
+            self.assertTrue(os.path.islink(source))
+            self.assertEqual([name for name in os.listdir(cache[0]["directory"]) if name.endswith(".new")], [])
+
+    def test_execute_rejects_selection(self):
+        sys.argv = ["test", "execute", "--plan", "plan.json", "--shard", "0", "-p", "opa"]
+        with self.assertRaisesRegex(ValueError, "--product"):
+            bake_args()
+
+
+if __name__ == "__main__":
+    unittest.main()
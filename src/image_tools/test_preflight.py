@@ -0,0 +1,67 @@
+from image_tools.test import conf
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from image_tools.args import preflight_args
+from image_tools.bake import generate_bakefile
+from image_tools.graph import BuildGraph
+from image_tools.lib import Command
+from image_tools.preflight import get_preflight_failures, preflight_checks
+from image_tools.preflight_cache import PreflightCache
+
+
+def fake_preflight(delay: float, failed: str) -> Command:
+    return Command(args=["sh", "-c", f'sleep {delay}; echo \'{{"results": {{"failed": [{failed}]}}}}\''])
+
+
+class TestPreflight(unittest.TestCase):
+    def test_concurrent_failures_keep_order(self):
+        commands = {
+            "slow": fake_preflight(0.3, '"slow-check"'),
+            "fast": fake_preflight(0, ""),
+            "timeout": fake_preflight(5, ""),
+        }
+        failures = get_preflight_failures(commands, jobs=3, timeout=1)
+        self.assertEqual(list(failures.keys()), ["slow", "fast", "timeout"])
+        self.assertEqual(failures["slow"], ["slow-check"])
+        self.assertEqual(failures["fast"], [])
+        self.assertEqual(failures["timeout"], ["preflight: timed out after 1 seconds"])
+
+    def test_products_without_images(self):
+        sys.argv = ["check-container", "-p", "typo", "-p", "opa=0.51.0", "-i", "0.0.0-dev"]
+        args = preflight_args()
+        graph = BuildGraph.from_conf(conf)
+        with self.assertLogs(level="ERROR"):
+            checks, missing = preflight_checks(args, generate_bakefile(args, conf, graph), graph)
+        self.assertEqual([check.product for check in checks], ["opa=0.51.0"])
+        self.assertEqual(missing, ["typo"])
+
+    def test_timeout_must_be_positive(self):
+        sys.argv = ["check-container", "-p", "opa", "-i", "24.7.0", "--timeout", "0"]
+        with self.assertRaisesRegex(ValueError, "timeout"):
+            preflight_args()
+
+    def test_cache_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = PreflightCache(tmp, max_age=60, max_entries=2)
+            keys = [PreflightCache.key(f"sha256:{i}", "1.9.0", "linux/amd64", False) for i in range(3)]
+            for i, key in enumerate(keys):
+                cache.put(key, f"image:{i}", [])
+                os.utime(os.path.join(tmp, f"{key}.json"), (time.time() - 10 + i,) * 2)
+            self.assertEqual(cache.get(keys[2])["image"], "image:2")
+
+            cache.evict()
+            self.assertIsNone(cache.get(keys[0]))
+            self.assertIsNotNone(cache.get(keys[1]))
+
+            os.utime(os.path.join(tmp, f"{keys[1]}.json"), (time.time() - 120,) * 2)
+            self.assertIsNone(cache.get(keys[1]))
+            cache.evict()
+            self.assertEqual(os.listdir(tmp), [f"{keys[2]}.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
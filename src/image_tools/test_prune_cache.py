@@ -0,0 +1,58 @@
+import io
+import sys
+import unittest
+from subprocess import CalledProcessError
+from types import SimpleNamespace
+from unittest import mock
+
+from image_tools.prune_cache import branch_cache_tags, main
+
+CONF = SimpleNamespace(
+    products=[{"name": "opa", "versions": [{"product": "0.51.0"}]}],
+    cache=[
+        {"type": "registry", "ref_prefix": "registry/cache", "branch_scoped": True},
+        {"type": "registry", "ref_prefix": "registry/other-cache", "branch_scoped": True},
+    ],
+)
+
+
+class TestPruneCache(unittest.TestCase):
+    def test_branch_cache_tags(self):
+        tags = [
+            "opa-0_51_0-linux_amd64",
+            "opa-0_51_0-linux_amd64-opa",
+            "opa-0_51_0-linux_arm64-opa",
+            "opa-0_51_0-linux_amd64-feat-opa",
+            "java-base-11-linux_amd64-opa",
+            "unknown-1_0_0-linux_amd64-opa",
+        ]
+        self.assertEqual(
+            branch_cache_tags(tags, ["opa-0_51_0", "java-base-11"], "opa"),
+            ["opa-0_51_0-linux_amd64-opa", "opa-0_51_0-linux_arm64-opa", "java-base-11-linux_amd64-opa"],
+        )
+        self.assertEqual(branch_cache_tags(tags, ["opa-0_51_0"], "feat-opa"), ["opa-0_51_0-linux_amd64-feat-opa"])
+
+    def prune(self, error):
+        sys.argv = ["prune-cache", "--branch", "feat/opa", "--dry"]
+        stderr = io.StringIO()
+        with (
+            mock.patch("image_tools.prune_cache.load_configuration", return_value=CONF),
+            mock.patch("image_tools.prune_cache.run", side_effect=error),
+            mock.patch("sys.stderr", stderr),
+        ):
+            return main(), stderr.getvalue()
+
+    def test_list_tags_fails(self):
+        returncode, stderr = self.prune(CalledProcessError(1, "skopeo", stderr="unauthorized\n"))
+        # Each repository is tried
+        self.assertEqual(returncode, 2)
+        self.assertIn("Failed to list the tags of registry/cache: unauthorized", stderr)
+
+    def test_skopeo_missing(self):
+        returncode, stderr = self.prune(FileNotFoundError("skopeo"))
+        self.assertEqual(returncode, 1)
+        self.assertIn("skopeo is required", stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
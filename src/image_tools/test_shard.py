@@ -0,0 +1,78 @@
+from image_tools.test import conf
+import json
+import os
+import tempfile
+import unittest
+import sys
+
+from image_tools.args import bake_args
+from image_tools.bake import generate_bakefile, targets_for_selector
+from image_tools.graph import BuildGraph
+from image_tools.shard import duplicated_builds, shard_targets, target_ancestors
+from image_tools.timings import load_timings, update_timings
+
+
+class TestShard(unittest.TestCase):
+    def setUp(self):
+        sys.argv = ["test"]
+        self.bakefile = generate_bakefile(bake_args(), conf)
+        self.graph = BuildGraph.from_conf(conf)
+
+    def test_target_ancestors(self):
+        self.assertEqual(
+            target_ancestors(self.bakefile, "druid-26_0_0"),
+            {"java-base-11", "vector-0_31_0", "stackable-base-1_0_0"},
+        )
+        self.assertEqual(self.graph.ancestors("druid-26_0_0"), target_ancestors(self.bakefile, "druid-26_0_0"))
+        self.assertIn("druid-26_0_0", self.graph.descendants("java-base-11"))
+        self.assertIn("java-base-11", self.graph.children("vector-0_31_0"))
+
+    def test_modulo_shards(self):
+        targets = targets_for_selector(conf, ["opa"])
+        shards = shard_targets(targets, 2)
+        self.assertEqual(shards[0], targets[0::2])
+        self.assertEqual(shards[1], targets[1::2])
+
+    def test_dependency_shards_keep_chains_together(self):
+        targets = targets_for_selector(conf, ["druid", "hello-world", "trino=414"])
+        shards = shard_targets(targets, 2, "dependency", self.graph)
+        self.assertEqual(sorted(sum(shards, [])), sorted(targets))
+        self.assertEqual([len(shard) for shard in shards], [3, 2])
+        # The java-base 11 and java-base 17 chains only share vector and stackable-base.
+        self.assertEqual(duplicated_builds(shards, self.graph), [2, 2])
+        modulo = shard_targets(targets, 2)
+        self.assertLess(sum(duplicated_builds(shards, self.graph)), sum(duplicated_builds(modulo, self.graph)))
+
+    def test_weighted_shards_balance_durations(self):
+        targets = targets_for_selector(conf, ["opa"])
+        timings = {target: 1.0 for target in targets}
+        timings["opa-0_51_0"] = 5.0
+        shards = shard_targets(targets, 2, "weighted", self.graph, timings)
+        self.assertEqual(shards[0], ["opa-0_51_0"])
+        self.assertEqual(len(shards[1]), len(targets) - 1)
+
+    def test_update_timings(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "timings.json")
+            self.assertEqual(load_timings(path, "linux/amd64"), {})
+            update_timings(path, {"opa-0_51_0": 10.0}, "linux/amd64")
+            update_timings(path, {"opa-0_51_0": 20.0, "opa-0_45_0": 4.0}, "linux/amd64")
+            self.assertEqual(load_timings(path, "linux/amd64"), {"opa-0_51_0": 15.0, "opa-0_45_0": 4.0})
+
+    def test_timings_per_platform(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "timings.json")
+            # A store without platforms
+            with open(path, "w") as f:
+                json.dump({"opa-0_51_0": 10.0}, f)
+            self.assertEqual(load_timings(path, "linux/arm64"), {"opa-0_51_0": 10.0})
+
+            update_timings(path, {"opa-0_51_0": 20.0}, "linux/amd64")
+            # Emulated builds take longer, but don't change the durations of the native ones
+            update_timings(path, {"opa-0_51_0": 200.0}, "linux/arm64")
+            self.assertEqual(load_timings(path, "linux/amd64"), {"opa-0_51_0": 15.0})
+            self.assertEqual(load_timings(path, "linux/arm64"), {"opa-0_51_0": 200.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
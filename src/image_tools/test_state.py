@@ -0,0 +1,31 @@
+import json
+import os
+import tempfile
+import unittest
+
+from image_tools.state import RunState
+
+
+class TestRunState(unittest.TestCase):
+    def test_resume_drops_changed_targets(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "state.json")
+            state = RunState(path, {"vector": "a", "opa": "b"})
+            state.record("vector", "sha256:1")
+            state.record("opa", "sha256:2")
+
+            # Runs that don't build anything keep the state of the previous run
+            fresh = RunState(path, {"vector": "a", "opa": "b"})
+            self.assertEqual(fresh.finished(), {})
+            with open(path) as f:
+                self.assertEqual(list(json.load(f)["targets"].keys()), ["vector", "opa"])
+
+            resumed = RunState(path, {"vector": "a", "opa": "changed"}, resume=True)
+            self.assertEqual(resumed.finished(), {"vector": "sha256:1"})
+            resumed.record("opa", "sha256:3")
+            with open(path) as f:
+                self.assertEqual(json.load(f)["targets"]["opa"]["digest"], "sha256:3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Store for historical build durations of Bakefile targets.
+
+The store is a local JSON file mapping platforms to target names to a build duration in seconds,
+e.g. `{"linux/amd64": {"opa-0_51_0": 312.5}}`, so that the durations of emulated builds don't skew
+the ones of native builds. It is read by the weighted shard strategy and updated after each
+successful build. Stores without platforms, written by earlier versions, are used for every
+platform until they are updated.
+"""
+
+import json
+import os
+import statistics
+import threading
+from typing import Any, Dict, List, Optional
+
+from .lib import write_atomic
+
+# Weight of a new measurement when updating the stored duration of a target.
+# Smooths out outliers such as cold caches or slow registry pulls.
+SMOOTHING = 0.5
+
+# Duration assumed for every target if the store doesn't contain any measurements yet.
+DEFAULT_DURATION = 1.0
+
+# Multi-architecture builds update the store from one thread per architecture
+_update_lock = threading.Lock()
+
+
+def _load_store(path: Optional[str]) -> Dict[str, Any]:
+    """The timings store. A missing file is treated as an empty store."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _is_legacy(store: Dict[str, Any]) -> bool:
+    """Whether the store maps targets to durations directly, without platforms."""
+    return any(isinstance(value, (int, float)) for value in store.values())
+
+
+def load_timings(path: Optional[str], platform: str) -> Dict[str, float]:
+    """Load the timings of the platform from the store."""
+    store = _load_store(path)
+    timings = store if _is_legacy(store) else store.get(platform, {})
+    return {target: float(seconds) for target, seconds in timings.items()}
+
+
+def save_timings(path: str, store: Dict[str, Dict[str, float]]) -> None:
+    """Write the timings store atomically so concurrent readers never see a partial file."""
+    content = {platform: dict(sorted(timings.items())) for platform, timings in sorted(store.items())}
+    write_atomic(path, json.dumps(content, indent=2) + "\n")
+
+
+def update_timings(path: str, durations: Dict[str, float], platform: str) -> Dict[str, float]:
+    """Merge newly measured durations into the timings of the platform and return its updated timings."""
+    with _update_lock:
+        store = _load_store(path)
+        # The durations of a store without platforms become the ones of the first platform that updates it
+        store = {platform: store} if _is_legacy(store) else store
+        timings = {target: float(seconds) for target, seconds in store.get(platform, {}).items()}
+        for target, seconds in durations.items():
+            previous = timings.get(target)
+            timings[target] = seconds if previous is None else (1 - SMOOTHING) * previous + SMOOTHING * seconds
+        store[platform] = timings
+        save_timings(path, store)
+    return timings
+
+
+def estimate_durations(targets: List[str], timings: Dict[str, float]) -> Dict[str, float]:
+    """Durations for the given targets. Targets without measurements get the median of the known ones."""
+    default = statistics.median(timings.values()) if timings else DEFAULT_DURATION
+    return {target: timings.get(target, default) for target in targets}
+
+
+def split_elapsed_time(targets: List[str], elapsed: float, timings: Dict[str, float]) -> Dict[str, float]:
+    """
+    Attribute the wall time of a bake run to its targets.
+
+    buildx builds all targets of a run together, so the elapsed time is split in proportion
+    to the previous estimates of the targets.
+    """
+    estimates = estimate_durations(targets, timings)
+    total = sum(estimates.values())
+    if total <= 0:
+        return {target: elapsed / len(targets) for target in targets}
+    return {target: elapsed * estimate / total for target, estimate in estimates.items()}